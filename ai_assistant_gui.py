@@ -1,11 +1,12 @@
 import sys
 import json
-import subprocess
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QSlider, QLabel, QTextEdit, QPushButton, QGridLayout
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from PyQt5.QtGui import QPainter, QColor, QPen, QPalette
+from PyQt5.QtGui import QPainter, QColor, QPen, QPalette, QTextCursor
 from resource_manager import ResourceManager, ResourceContext
+from app import AssistantEngine
 from custom_errors import AIAssistantError
+from tracing import RollingPercentiles
 
 class LEDIndicator(QWidget):
     def __init__(self, parent=None):
@@ -28,38 +29,39 @@ class AIAssistantThread(QThread):
     output_received = pyqtSignal(str)
     status_changed = pyqtSignal(str)
     update_complete = pyqtSignal()
+    partial_response_received = pyqtSignal(str)
+    response_received = pyqtSignal(str)
+    timings_received = pyqtSignal(int, dict)
 
     def __init__(self, resource_manager):
         super().__init__()
         self.resource_manager = resource_manager
-        self.process = None
-        self._stop_event = False
+        self.engine = None
 
     def run(self):
         try:
-            self.process = subprocess.Popen(['python', 'app.py'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1, universal_newlines=True)
-            self.status_changed.emit('running')
-            
-            while not self._stop_event and self.process.poll() is None:
-                output = self.process.stdout.readline()
-                if output:
-                    self.output_received.emit(output.strip())
-                    if "AI assistant configuration updated and saved to file." in output:
-                        self.update_complete.emit()
+            # Drive the assistant in this process, sharing the GUI's already initialized resources
+            self.engine = AssistantEngine(
+                self.resource_manager,
+                on_status=self.status_changed.emit,
+                on_partial_response=self.partial_response_received.emit,
+                on_response=self.response_received.emit,
+                on_timing=self.timings_received.emit,
+                on_config_updated=self.update_complete.emit,
+                on_error=lambda message: self.output_received.emit(f"Error: {message}")
+            )
+            self.engine.start()
+            self.engine.run()
         except Exception as e:
-            self.output_received.emit(f"Error in AI Assistant process: {str(e)}")
+            self.output_received.emit(f"Error in AI Assistant: {str(e)}")
         finally:
+            if self.engine:
+                self.engine.stop()
             self.status_changed.emit('stopped')
 
     def stop(self):
-        self._stop_event = True
-        if self.process:
-            self.process.terminate()
-            try:
-                self.process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                self.process.kill()
-            self.process = None
+        if self.engine:
+            self.engine.request_stop()
 
 class AIAssistantGUI(QWidget):
     def __init__(self, resource_manager):
@@ -67,8 +69,10 @@ class AIAssistantGUI(QWidget):
         self.resource_manager = resource_manager
         self.ai_thread = None
         self.config_status = 'no_config'
-        self.capturing_response = False
-        self.current_response = ""
+        self.streaming_response = False
+        # Rolling latency over the last 50 turns, shown next to the LED
+        self.turn_latency = RollingPercentiles(window=50)
+        self.first_audio_latency = RollingPercentiles(window=50)
         self.traits = {
             'openness': 50, 'conscientiousness': 50, 'extraversion': 50, 'agreeableness': 50,
             'neuroticism': 50, 'creativity': 50, 'curiosity': 50, 'assertiveness': 50,
@@ -221,6 +225,11 @@ class AIAssistantGUI(QWidget):
         self.led_indicator = LEDIndicator()
         control_layout.addWidget(self.led_indicator)
 
+        self.latency_label = QLabel('Turn: -   First audio: -')
+        self.latency_label.setStyleSheet("color: white;")
+        self.latency_label.setToolTip('Rolling p50 / p95 over the last 50 turns')
+        control_layout.addWidget(self.latency_label)
+
         self.status_label = QLabel('AI Assistant Status: Not Running')
         self.status_label.setStyleSheet("color: white;")
         control_layout.addWidget(self.status_label)
@@ -322,6 +331,9 @@ class AIAssistantGUI(QWidget):
                 self.ai_thread = AIAssistantThread(self.resource_manager)
                 self.ai_thread.output_received.connect(self.process_output)
                 self.ai_thread.status_changed.connect(self.update_status)
+                self.ai_thread.partial_response_received.connect(self.process_partial_response)
+                self.ai_thread.response_received.connect(self.process_response)
+                self.ai_thread.timings_received.connect(self.process_timings)
                 self.ai_thread.start()
                 self.start_stop_button.setText('Stop AI Assistant')
                 self.config_status = 'started'
@@ -336,26 +348,46 @@ class AIAssistantGUI(QWidget):
             self.response_text.append(f"Error toggling AI Assistant: {str(e)}")
 
     def update_status(self, status):
-        if status == 'running':
+        if status == 'stopped':
+            self.status_label.setText('AI Assistant Status: Not Running')
+            self.config_status = 'updated'
+        elif status == 'running':
             self.status_label.setText('AI Assistant Status: Running')
             self.config_status = 'running'
         else:
-            self.status_label.setText('AI Assistant Status: Not Running')
-            self.config_status = 'updated'
+            # listening / thinking / speaking
+            self.status_label.setText(f'AI Assistant Status: {status.title()}')
         self.update_led_color()
 
     def process_output(self, output):
-        if output == "CHATGPT_RESPONSE_START":
-            self.capturing_response = True
-            self.current_response = ""
-        elif output == "CHATGPT_RESPONSE_END":
-            self.capturing_response = False
-            self.response_text.append(self.current_response)
-            self.current_response = ""
-        elif self.capturing_response:
-            self.current_response += output + "\n"
-        else:
-            self.response_text.append(output)
+        self.response_text.append(output)
+
+    def process_partial_response(self, text):
+        if not self.streaming_response:
+            self.streaming_response = True
+            self.response_text.append("")
+        self.response_text.moveCursor(QTextCursor.End)
+        self.response_text.insertPlainText(text)
+
+    def process_response(self, response):
+        # A streamed response is already on screen
+        if not self.streaming_response:
+            self.response_text.append(response)
+        self.streaming_response = False
+
+    def process_timings(self, turn_id, timings):
+        if 'total' in timings:
+            self.turn_latency.add(timings['total'])
+        if 'first_audio' in timings:
+            self.first_audio_latency.add(timings['first_audio'])
+        self.latency_label.setText(f"Turn: {self.format_latency(self.turn_latency)}   "
+                                   f"First audio: {self.format_latency(self.first_audio_latency)}")
+
+    @staticmethod
+    def format_latency(latency):
+        if latency.percentile(50) is None:
+            return '-'
+        return f"p50 {latency.percentile(50):.2f}s / p95 {latency.percentile(95):.2f}s"
 
     def update_led_color(self):
         if self.config_status == 'no_config':
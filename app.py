@@ -1,84 +1,395 @@
-import time
-import keyboard
 import json
+import threading
+import time
 from rich import print
 from resource_manager import ResourceManager, ResourceContext, AIAssistantError
+from custom_errors import TurnCancelled
+from streaming_pipeline import StreamingPipeline, spoken_prefix
+from speculation import SpeculativePrefetcher
+from filler_library import FillerLibrary, phrases_for_config
+from pipeline import InteractionPipeline, Turn
+from chat_journal import ChatJournal
+from config_watcher import ConfigWatcher
+from tracing import tracer
+from hotkeys import HotkeyDispatcher
 
 ELEVENLABS_VOICE = "Aaryan"  # Replace this with the name of whatever voice you have created on Elevenlabs
-BACKUP_FILE = "ChatHistoryBackup.txt"
+BACKUP_FILE = "ChatHistoryBackup.txt"  # Legacy full-history backup, only read to seed a new journal
+JOURNAL_FILE = "ChatHistory.jsonl"
 CONFIG_FILE = "ai_assistant_config.json"
+MAX_PENDING_TURNS = 2  # How many F4 presses can wait while earlier turns are still being handled
+STREAMING_MODE = True  # Speak the answer sentence by sentence while ChatGPT is still writing it
+ENDPOINTING_MODE = True  # End the question automatically when you stop talking, instead of waiting for 'p'
+ENDPOINT_SILENCE_MS = 700  # How long a pause has to be before the question counts as finished
+FILLER_MODE = True  # Say a short "Hmm, good question..." while the answer is on its way
+SPECULATIVE_MODE = False  # Start asking ChatGPT while you are still talking; costs extra requests when the guess is wrong
+HOTKEYS = {'start': 'f4', 'stop': 'p', 'cancel': 'esc', 'replay': 'f5'}  # Change these to rebind the controls
+BARGE_IN = True  # Starting a new interaction cuts off the answer that is still being prepared or spoken
+TRACING_MODE = False  # Record how long each step of every turn takes, see TRACE_FILE and CHROME_TRACE_FILE
+TRACE_FILE = "trace.jsonl"  # One JSON line per span, written as the spans finish
+CHROME_TRACE_FILE = "trace.chrome.json"  # Written on stop; open it in chrome://tracing or ui.perfetto.dev
 
-def load_ai_config():
-    try:
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
-        print("AI assistant configuration loaded from file.")
-        return config
-    except FileNotFoundError:
-        print("[yellow]No custom configuration found. Using default settings.[/yellow]")
-        return None
-    except json.JSONDecodeError:
-        print("[red]Error decoding the configuration file. Using default settings.[/red]")
-        return None
-
-def update_system_message(config, openai_manager):
-    if config is None:
+def update_system_message(config_watcher, openai_manager, applied_version):
+    """Applies the watcher's cached system message if it changed. Returns the version now in use."""
+    version, system_message = config_watcher.current()
+    if version != applied_version and system_message is not None:
+        openai_manager.chat_history.set_system_message(system_message)
+    return version
+
+def restore_chat_history(resource_manager, journal):
+    """Loads the journal into the chat history, unless the history already holds a conversation.
+
+    The GUI stops and starts the engine on the same ResourceManager, so after the
+    first start the history is already the live copy of the journal.
+    """
+    history = resource_manager.openai.chat_history
+    if history.conversation() or history.summary_message:
         return
 
-    custom_text = config.get('custom_text', '')
+    messages = journal.load()
+    if not messages:
+        try:
+            with open(BACKUP_FILE, 'r') as f:
+                messages = json.load(f)
+            print("Seeding the chat journal from the old backup file.")
+        except (FileNotFoundError, json.JSONDecodeError):
+            messages = []
 
-    new_system_message = {
-        "role": "system",
-        "content": custom_text
-    }
+    # The conversation summary is a system message too, but it belongs to the history
+    history.extend(message for message in messages
+                   if message.get('role') != 'system' or message.get('name') == history.SUMMARY_NAME)
+    history.trim(8000)
 
-    if openai_manager.chat_history and openai_manager.chat_history[0]['role'] == 'system':
-        openai_manager.chat_history[0] = new_system_message
-    else:
-        openai_manager.chat_history.insert(0, new_system_message)
+    # Start the session from a journal that holds exactly the live history
+    journal.compact(history.persistent_messages())
+    if len(history.conversation()):
+        print(f"[coral]Restored {len(history.conversation())} messages from the chat journal.")
+    resource_manager.openai.compact_context()
 
-def main_loop(resource_manager):
-    print("[green]AI Assistant is running. Press F4 to start an interaction, or press Ctrl+C to exit.[/green]")
-    try:
-        while True:
-            if keyboard.read_key() != "f4":
-                time.sleep(0.1)
-                continue
+class AssistantEngine:
+    """The F4 -> listen -> respond -> speak pipeline, embeddable in another process such as the GUI.
+
+    Progress is reported through optional callbacks instead of parsed console output:
+    on_status(str), on_partial_transcript(str), on_partial_response(str), on_response(str),
+    on_timing(turn_id, dict), on_config_updated() and on_error(str).
+    """
+
+    def __init__(self, resource_manager, voice=ELEVENLABS_VOICE, config_file=CONFIG_FILE, journal_file=JOURNAL_FILE,
+                 streaming=STREAMING_MODE, endpointing=ENDPOINTING_MODE, speculative=SPECULATIVE_MODE, fillers=FILLER_MODE, tracing=TRACING_MODE, hotkeys=HOTKEYS, barge_in=BARGE_IN, on_status=None, on_partial_transcript=None,
+                 on_partial_response=None, on_response=None, on_timing=None, on_config_updated=None, on_error=None):
+        self.resource_manager = resource_manager
+        self.voice = voice
+        self.streaming = streaming
+        self.endpointing = endpointing
+        self.speculative = speculative
+        self.prefetcher = None
+        self.filler_library = FillerLibrary(resource_manager) if fillers else None
+        self.tracing = tracing
+        self.barge_in = barge_in
+        self.on_partial_transcript = on_partial_transcript
+        self.on_status = on_status
+        self.on_partial_response = on_partial_response
+        self.on_response = on_response
+        self.on_timing = on_timing
+        self.on_config_updated = on_config_updated
+        self.on_error = on_error
+        self.journal = ChatJournal(journal_file)
+        self.config_watcher = ConfigWatcher(config_file)
+        self.config_watcher.add_callback(self._config_updated)
+        self.pipeline = None
+        self.hotkeys = HotkeyDispatcher(hotkeys)
+        self.hotkeys.on('start', self.start_turn)
+        self.hotkeys.on('stop', self.stop_listening)
+        self.hotkeys.on('cancel', self.cancel)
+        self.hotkeys.on('replay', self.replay)
+        self.last_response = None
+        self._last_answer = (None, None)  # last_response and, if it was streamed, the sentences it was synthesized in
+        self._listen_stop = threading.Event()  # Replaced for every turn; set by the stop hotkey
+        self._active_turns = set()  # Submitted turns that haven't finished yet
+        self._active_turns_lock = threading.Lock()
+        self._applied_config_version = 0
+        self._stop_event = threading.Event()
+
+    def _emit(self, callback, *args):
+        if callback:
+            callback(*args)
+
+    def _config_updated(self, config, system_message):
+        if self.filler_library:
+            # A new personality gets matching fillers; rebuild() is a no-op if the phrases didn't change
+            self.filler_library.rebuild(self.voice, phrases_for_config(config))
+        self._emit(self.on_config_updated)
+
+    def set_voice(self, voice):
+        """Speaks with another ElevenLabs voice from the next answer on."""
+        self.voice = voice
+        if self.filler_library:
+            self.filler_library.rebuild(voice, phrases_for_config(self.config_watcher.config))
+
+    def start(self):
+        self._stop_event.clear()
+        if self.tracing:
+            tracer.enable(TRACE_FILE)
+        restore_chat_history(self.resource_manager, self.journal)
+        if self.speculative:
+            self.prefetcher = SpeculativePrefetcher(self.resource_manager.openai)
+        self.config_watcher.start()
+        if self.filler_library and not self.config_watcher.version:
+            # Without a config file there is no reload callback, so build the neutral fillers now
+            self.filler_library.rebuild(self.voice, phrases_for_config(None))
+        self.pipeline = self._build_pipeline()
+        self.pipeline.start(self._turn_finished)
+        self._emit(self.on_status, 'running')
+
+    def request_stop(self):
+        """Makes run() return; safe to call from any thread."""
+        self._stop_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.pipeline:
+            # A listen stage that is still recording would otherwise keep the pipeline from stopping
+            self._cancel_active_turns()
+            self._listen_stop.set()
+            self.pipeline.stop(timeout=5)
+            self.pipeline = None
+        self.config_watcher.stop()
+        self.journal.close()
+        if self.prefetcher:
+            self.prefetcher.cleanup()
+            metrics = self.prefetcher.metrics
+            print(f"[coral]Speculative answers: {metrics['hits']} used, {metrics['misses']} discarded "
+                  f"({metrics['hit_rate']:.0%} hit rate), {metrics['saved_seconds']:.1f}s saved in total.")
+        if self.tracing:
+            self._export_trace()
+        self._emit(self.on_status, 'stopped')
+
+    def _export_trace(self):
+        tracer.export_chrome_trace(CHROME_TRACE_FILE)
+        tracer.disable()
+        print(f"[coral]Wrote {TRACE_FILE} and {CHROME_TRACE_FILE}. Per-step latency over the last turns:")
+        for name, stats in tracer.summary().items():
+            print(f"[coral]  {name:<20} n={stats['count']:<5} p50={stats['p50'] * 1000:8.1f} ms  p95={stats['p95'] * 1000:8.1f} ms")
+
+    def start_turn(self):
+        # Without barge-in the previous answer keeps playing and the new turn is captured alongside it
+        start_key = self.hotkeys.bindings['start'].upper()
+        if self.barge_in:
+            with self._active_turns_lock:
+                answering = [turn for turn in self._active_turns if turn.stage not in (None, 'listen')]
+            for turn in answering:
+                turn.cancel_token.cancel()
+        turn = Turn()
+        with self._active_turns_lock:
+            self._active_turns.add(turn)
+        if self.pipeline.submit(turn) is None:
+            with self._active_turns_lock:
+                self._active_turns.discard(turn)
+            print(f"[yellow]Still busy with earlier questions, ignoring this {start_key} press.[/yellow]")
+        else:
+            print(f"[green]User pressed {start_key}! Queued a new interaction.[/green]")
+
+    def stop_listening(self):
+        """Ends the question being recorded; it is then answered as usual."""
+        self._listen_stop.set()
 
-            print("[green]User pressed F4 key! Now listening to your microphone:[/green]")
+    def cancel(self):
+        """Cancels every turn in flight: listening stops, and answers are dropped or cut off where they are."""
+        self._cancel_active_turns()
+        self._listen_stop.set()
+        self.resource_manager.audio.stop()
+        print("[yellow]Cancelled.[/yellow]")
 
+    def _cancel_active_turns(self):
+        with self._active_turns_lock:
+            turns = list(self._active_turns)
+        for turn in turns:
+            turn.cancel_token.cancel()
+
+    def replay(self):
+        """Says the last answer again.
+
+        The audio is asked for the same way the answer was first synthesized, sentence by
+        sentence when it was streamed and as a whole otherwise, so it comes from the TTS cache
+        rather than ElevenLabs unless the cache is off or has evicted it.
+        """
+        response, sentences = self._last_answer
+        if not response:
+            return
+
+        def speak():
             try:
-                # Load the latest AI configuration
-                config = load_ai_config()
-                update_system_message(config, resource_manager.openai)
+                eleven_labs = self.resource_manager.eleven_labs
+                audio = self.resource_manager.audio
+                if sentences:
+                    for sentence in sentences:
+                        audio.enqueue_audio(eleven_labs.text_to_audio_bytes(sentence, self.voice), **eleven_labs.playback_format)
+                else:
+                    audio.play_audio(eleven_labs.text_to_audio(response, self.voice, False), False, eleven_labs.tts_cache is None, True)
+            except AIAssistantError as e:
+                self._emit(self.on_error, str(e))
+
+        threading.Thread(target=speak, name="replay", daemon=True).start()
+
+    def run(self):
+        """Handles the hotkeys until stop() is called from another thread or Ctrl+C is pressed."""
+        self.hotkeys.start()
+        keys = {action: key.upper() for action, key in self.hotkeys.bindings.items()}
+        print(f"[green]AI Assistant is running. Press {keys['start']} to start an interaction, {keys['stop']} to finish "
+              f"your question, {keys['cancel']} to cancel and {keys['replay']} to hear the last answer again. "
+              f"Press Ctrl+C to exit.[/green]")
+        try:
+            # Wake up now and then so Ctrl+C is noticed
+            while not self._stop_event.wait(0.5):
+                pass
+        finally:
+            self.hotkeys.stop()
+
+    def _build_pipeline(self):
+        resource_manager = self.resource_manager
+
+        def listen(turn):
+            self._emit(self.on_status, 'listening')
+            print(f"[green]Now listening to your microphone for turn {turn.id}:[/green]")
+            self._listen_stop = threading.Event()
+            prefetcher = self.prefetcher
+            on_partial, on_final = self.on_partial_transcript, None
+            if prefetcher:
+                prefetcher.start_turn()
+                on_final = prefetcher.on_final
 
-                # Get question from mic
-                mic_result = resource_manager.speech_to_text.speechtotext_from_mic_continuous()
-                
+                def on_partial(text):
+                    prefetcher.on_partial(text)
+                    self._emit(self.on_partial_transcript, text)
+
+            if self.endpointing:
+                turn.prompt = resource_manager.speech_to_text.speechtotext_from_mic_endpointed(
+                    silence_ms=ENDPOINT_SILENCE_MS, on_partial=on_partial, on_final=on_final, stop_event=self._listen_stop
+                )
+            else:
+                turn.prompt = resource_manager.speech_to_text.speechtotext_from_mic_continuous(
+                    stop_event=self._listen_stop, on_partial=on_partial, on_final=on_final
+                )
+            if prefetcher:
+                turn.speculation = prefetcher.finish_turn(turn.prompt)
+                if turn.speculation:
+                    turn.cancel_token.add_callback(turn.speculation.cancel)
+            turn.cancel_token.raise_if_cancelled()
+
+        def respond(turn):
+            # Pick up the latest AI configuration; it was already parsed when the file changed
+            self._applied_config_version = update_system_message(self.config_watcher, resource_manager.openai, self._applied_config_version)
+
+            self._emit(self.on_status, 'thinking')
+            self._play_filler()
+            sentences = None
+            if self.streaming:
+                # Stream the answer from OpenAI through ElevenLabs into the speakers, one sentence at a time
+                streaming_pipeline = StreamingPipeline(resource_manager, self.voice, self.on_partial_response)
+                turn.response = streaming_pipeline.run(turn.prompt, turn.cancel_token, turn.speculation)
+                sentences = streaming_pipeline.sentences
+                if streaming_pipeline.time_to_first_audio is not None:
+                    turn.timings['first_audio'] = streaming_pipeline.time_to_first_audio
+                if streaming_pipeline.cancelled:
+                    raise TurnCancelled(f"Turn {turn.id} was cancelled while answering.")
+            else:
                 # Send question to OpenAI
-                openai_result = resource_manager.openai.chat_with_history(mic_result)
-                
-                # Write the results to txt file as a backup
-                with open(BACKUP_FILE, "w") as file:
-                    json.dump(resource_manager.openai.chat_history, file, indent=2)
+                turn.response = resource_manager.openai.chat_with_history(turn.prompt, turn.cancel_token, turn.speculation)
+                turn.answer_message = resource_manager.openai.last_answer_message
+                if turn.cancel_token.cancelled:
+                    # Nothing was said yet, so the answer is replaced by a note that it was interrupted
+                    turn.response = resource_manager.openai.record_interrupted_answer("", turn.answer_message)
+                    raise TurnCancelled(f"Turn {turn.id} was cancelled while answering.")
 
-                # Mark the ChatGPT response for easy identification
-                print(f"CHATGPT_RESPONSE_START\n{openai_result}\nCHATGPT_RESPONSE_END")
+            if turn.response:
+                self.last_response = turn.response
+                self._last_answer = (turn.response, sentences)
+            self._emit(self.on_response, turn.response or "")
 
-                # Send it to ElevenLabs to turn into cool audio
-                elevenlabs_output = resource_manager.eleven_labs.text_to_audio(openai_result, ELEVENLABS_VOICE, False)
+        def synthesize(turn):
+            # Send it to ElevenLabs to turn into cool audio
+            if turn.response:
+                turn.audio_file = resource_manager.eleven_labs.text_to_audio(turn.response, self.voice, False)
+            if turn.cancel_token.cancelled:
+                turn.response = resource_manager.openai.record_interrupted_answer("", turn.answer_message)
+                raise TurnCancelled(f"Turn {turn.id} was cancelled before it was spoken.")
 
-                # Play the mp3 file
-                resource_manager.audio.play_audio(elevenlabs_output, True, True, True)
+        def play(turn):
+            # Play the mp3 file. It lives in the TTS cache, so it is kept for next time
+            if turn.audio_file:
+                self._emit(self.on_status, 'speaking')
+                # Cancelling the turn (the cancel hotkey or barge-in) stops the audio, which ends the wait early
+                turn.cancel_token.add_callback(resource_manager.audio.stop)
+                try:
+                    clip = None
+                    if not turn.cancel_token.cancelled:
+                        clip = resource_manager.audio.play_audio(turn.audio_file, False, resource_manager.eleven_labs.tts_cache is None, True)
+                        if turn.cancel_token.cancelled:
+                            # Cancelled between the check and the start; stop() may already have run
+                            resource_manager.audio.stop()
+                        with tracer.span("audio.playback"):
+                            clip.done.wait()
+                finally:
+                    turn.cancel_token.remove_callback(resource_manager.audio.stop)
+                if turn.cancel_token.cancelled:
+                    played_fraction = clip.played_fraction if clip is not None else 0.0
+                    turn.response = resource_manager.openai.record_interrupted_answer(
+                        spoken_prefix(turn.response, played_fraction), turn.answer_message
+                    )
+                    raise TurnCancelled(f"Turn {turn.id} was cut off while speaking.")
 
-                print("[green]\n!!!!!!!\nFINISHED PROCESSING DIALOGUE.\nREADY FOR NEXT INPUT\n!!!!!!!\n")
+        stages = [("listen", listen), ("respond", respond)]
+        if not self.streaming:
+            stages += [("synthesize", synthesize), ("play", play)]
+        return InteractionPipeline(stages, max_pending=MAX_PENDING_TURNS)
 
-            except AIAssistantError as e:
-                print(f"[red]An error occurred: {str(e)}[/red]")
-                print("[yellow]The AI Assistant will continue running. Press F4 to try again.[/yellow]")
+    def _play_filler(self):
+        # Only while nothing else is playing; the first sentence of the answer crossfades into it
+        if not self.filler_library or self.resource_manager.audio.is_playing:
+            return
+        filler = self.filler_library.pick()
+        if filler:
+            audio_bytes, playback_format = filler
+            self.resource_manager.audio.play_filler(audio_bytes, **playback_format)
+
+    def _turn_finished(self, turn):
+        with self._active_turns_lock:
+            self._active_turns.discard(turn)
+        if turn.speculation is not None and turn.error is not None:
+            turn.speculation.cancel()
+        turn.timings['total'] = time.monotonic() - turn.created_at
+        tracer.record("turn.total", turn.timings['total'], turn=turn.id)
+        self._emit(self.on_timing, turn.id, dict(turn.timings))
 
+        # Append just this turn to the journal as a backup; a cut off answer is kept as far as it was heard
+        if turn.prompt and turn.response and (turn.error is None or isinstance(turn.error, TurnCancelled)):
+            self.journal.append([
+                {"role": "user", "content": turn.prompt},
+                {"role": "assistant", "content": turn.response}
+            ])
+            # Trimmed and summarized messages stay in the journal until it is compacted
+            live_messages = self.resource_manager.openai.chat_history.persistent_messages()
+            if self.journal.record_count > 2 * len(live_messages) + 20:
+                self.journal.compact(live_messages)
+
+        if isinstance(turn.error, TurnCancelled):
+            print(f"[yellow]Turn {turn.id} was cancelled. Press {self.hotkeys.bindings['start'].upper()} to ask something else.[/yellow]")
+        elif turn.error is not None:
+            self._emit(self.on_error, str(turn.error))
+            print(f"[yellow]The AI Assistant will continue running. Press {self.hotkeys.bindings['start'].upper()} to try again.[/yellow]")
+        else:
+            print(f"[green]\n!!!!!!!\nFINISHED PROCESSING DIALOGUE {turn.id}.\nREADY FOR NEXT INPUT\n!!!!!!!\n")
+        self._emit(self.on_status, 'running')
+
+def main_loop(resource_manager):
+    engine = AssistantEngine(resource_manager)
+    engine.start()
+    try:
+        engine.run()
     except KeyboardInterrupt:
         print("[yellow]AI Assistant stopping...[/yellow]")
+    finally:
+        engine.stop()
 
 if __name__ == "__main__":
     with ResourceContext() as resource_manager:
@@ -86,4 +397,4 @@ if __name__ == "__main__":
             main_loop(resource_manager)
         except Exception as e:
             print(f"[red]A critical error occurred: {str(e)}[/red]")
-            print("[red]The AI Assistant will now exit.[/red]")
\ No newline at end of file
+            print("[red]The AI Assistant will now exit.[/red]")
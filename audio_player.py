@@ -1,102 +1,125 @@
-import pygame
-import time
 import os
+import time
 import asyncio
-import soundfile as sf
-from mutagen.mp3 import MP3
 from custom_errors import AIAssistantError
+from playback_engine import PlaybackEngine
+from audio_processing import AudioPostProcessor
+from tracing import tracer
 
 class AudioManager:
-    def __init__(self):
-        self.mixer = None
+    def __init__(self, frequency=48000, channels=2, chunk_size=1024, post_process=True):
+        # Use higher frequency to prevent audio glitching noises
+        # Use higher buffer because why not (SDL's default is 512)
+        # post_process trims the silence ElevenLabs puts around clips and evens out their volume
+        processor = AudioPostProcessor() if post_process else None
+        self.engine = PlaybackEngine(frequency=frequency, channels=channels, chunk_size=chunk_size, processor=processor)
+        self.mixer = None  # Only opened for play_using_music=False, where clips may overlap
 
     def initialize(self):
-        try:
-            # Use higher frequency to prevent audio glitching noises
-            # Use higher buffer because why not (default is 512)
-            pygame.mixer.init(frequency=48000, buffer=1024)
-            self.mixer = pygame.mixer
-        except pygame.error as e:
-            raise AIAssistantError(f"Failed to initialize pygame mixer: {str(e)}")
+        if not self.engine.device:
+            self.engine.open()
 
     def cleanup(self):
+        self.engine.close()
         if self.mixer:
             self.mixer.quit()
 
     def _ensure_initialized(self):
-        if not self.mixer:
+        if not self.engine.device:
             self.initialize()
 
+    def _ensure_mixer(self):
+        if not self.mixer:
+            import pygame
+            try:
+                pygame.mixer.init(frequency=self.engine.frequency, channels=self.engine.channels, buffer=self.engine.chunk_size)
+                self.mixer = pygame.mixer
+            except pygame.error as e:
+                raise AIAssistantError(f"Failed to initialize pygame mixer: {str(e)}")
+
     def play_audio(self, file_path, sleep_during_playback=True, delete_file=False, play_using_music=True):
-        self._ensure_initialized()
-        
+        """Plays a wav or mp3 file. With play_using_music the clip is returned, and stop() ends the wait early."""
         try:
-            print(f"Playing file with pygame: {file_path}")
-            
+            print(f"Playing file: {file_path}")
+            # The whole clip is read into memory, so the file can be deleted straight away
+            with tracer.span("audio.load"), open(file_path, 'rb') as f:
+                audio_bytes = f.read()
+
+            if delete_file:
+                try:
+                    os.remove(file_path)
+                    print(f"Deleted the audio file.")
+                except PermissionError:
+                    print(f"Couldn't remove {file_path} because it is being used by another process.")
+                except OSError as e:
+                    raise AIAssistantError(f"Error deleting audio file: {str(e)}")
+
             if play_using_music:
-                # Pygame Music can only play one file at a time
-                self.mixer.music.load(file_path)
-                self.mixer.music.play()
+                clip = self.play_bytes(audio_bytes, self._format_from_path(file_path))
+                if sleep_during_playback:
+                    # Returns as soon as the last sample is out, rather than after a computed sleep
+                    with tracer.span("audio.playback"):
+                        clip.done.wait()
+                return clip
             else:
                 # Pygame Sound lets you play multiple sounds simultaneously
-                pygame_sound = self.mixer.Sound(file_path) 
+                self._ensure_mixer()
+                pygame_sound = self.mixer.Sound(buffer=self.engine.prepare(audio_bytes, self._format_from_path(file_path)))
                 pygame_sound.play()
+                if sleep_during_playback:
+                    time.sleep(pygame_sound.get_length())
 
-            if sleep_during_playback:
-                # Calculate length of the file, based on the file format
-                _, ext = os.path.splitext(file_path)
-                if ext.lower() == '.wav':
-                    with sf.SoundFile(file_path) as wav_file:
-                        file_length = wav_file.frames / wav_file.samplerate
-                elif ext.lower() == '.mp3':
-                    mp3_file = MP3(file_path)
-                    file_length = mp3_file.info.length
-                else:
-                    raise AIAssistantError("Cannot play audio, unknown file type")
-
-                # Sleep until file is done playing
-                time.sleep(file_length)
-
-                # Delete the file
-                if delete_file:
-                    # Stop Pygame so file can be deleted
-                    self.mixer.music.stop()
-                    self.mixer.quit()
-                    try:  
-                        os.remove(file_path)
-                        print(f"Deleted the audio file.")
-                    except PermissionError:
-                        print(f"Couldn't remove {file_path} because it is being used by another process.")
-                    except OSError as e:
-                        raise AIAssistantError(f"Error deleting audio file: {str(e)}")
-                    finally:
-                        # Reinitialize mixer after deletion attempt
-                        self.initialize()
-
+        except AIAssistantError:
+            raise
         except Exception as e:
             raise AIAssistantError(f"Error playing audio: {str(e)}")
 
     async def play_audio_async(self, file_path):
-        self._ensure_initialized()
-        
         try:
-            print(f"Playing file asynchronously with pygame: {file_path}")
-            pygame_sound = self.mixer.Sound(file_path) 
-            pygame_sound.play()
-
-            # Calculate length of the file, based on the file format
-            _, ext = os.path.splitext(file_path)
-            if ext.lower() == '.wav':
-                with sf.SoundFile(file_path) as wav_file:
-                    file_length = wav_file.frames / wav_file.samplerate
-            elif ext.lower() == '.mp3':
-                mp3_file = MP3(file_path)
-                file_length = mp3_file.info.length
-            else:
-                raise AIAssistantError("Cannot play audio, unknown file type")
+            print(f"Playing file asynchronously: {file_path}")
+            with open(file_path, 'rb') as f:
+                clip = self.play_bytes(f.read(), self._format_from_path(file_path))
 
-            # We must use asyncio.sleep() here because the normal time.sleep() will block the thread, even if it's in an async function
-            await asyncio.sleep(file_length)
+            # Wait on the clip's done event in a worker thread so the event loop stays free
+            await asyncio.get_running_loop().run_in_executor(None, clip.done.wait)
 
+        except AIAssistantError:
+            raise
         except Exception as e:
             raise AIAssistantError(f"Error playing audio asynchronously: {str(e)}")
+
+    @staticmethod
+    def _format_from_path(file_path):
+        _, ext = os.path.splitext(file_path)
+        if ext.lower() not in ('.wav', '.mp3'):
+            raise AIAssistantError("Cannot play audio, unknown file type")
+        return ext.lower()[1:]
+
+    def play_bytes(self, audio, audio_format='mp3', sample_rate=None, channels=None):
+        """Queues an in-memory clip (bytes or memoryview) and returns it; wait on clip.done to block until it ends."""
+        self._ensure_initialized()
+        return self.engine.enqueue(audio, audio_format, sample_rate, channels)
+
+    def enqueue_audio(self, audio_bytes, audio_format='mp3', sample_rate=None, channels=None):
+        """Queues an in-memory clip to play right after the previously queued one, without gaps.
+
+        Pass ElevenLabsManager.playback_format as keyword arguments for audio from text_to_audio_bytes().
+        """
+        return self.play_bytes(audio_bytes, audio_format, sample_rate, channels)
+
+    def play_filler(self, audio_bytes, audio_format='mp3', sample_rate=None, channels=None):
+        """Starts a short filler clip; the next clip queued crossfades into it as soon as it is ready."""
+        self._ensure_initialized()
+        return self.engine.enqueue(audio_bytes, audio_format, sample_rate, channels, interruptible=True)
+
+    @property
+    def is_playing(self):
+        return not self.engine.wait(0)
+
+    def wait_for_queued_audio(self, timeout=None):
+        """Blocks until every queued clip has finished playing."""
+        return self.engine.wait(timeout)
+
+    def stop(self):
+        """Stops playback immediately and drops anything still queued."""
+        self.engine.stop()
@@ -0,0 +1,70 @@
+import numpy as np
+
+class AudioPostProcessor:
+    """Trims silence from the ends of a TTS clip and evens out its loudness before playback.
+
+    Samples are int16 arrays shaped (frames, channels). The clip is cut into frame_ms
+    frames and each frame's level is computed in one NumPy pass. The clip is trimmed to
+    the first and last frame above silence_db, keeping a little of the surrounding
+    silence so words don't start or end abruptly. Loudness is measured LUFS-style as the
+    RMS over the frames that aren't silent, so pauses don't drag the measurement down.
+    A single gain then brings it to target_db, capped at max_gain_db and by the clip's
+    peak so nothing clips.
+    """
+
+    def __init__(self, frame_ms=10, silence_db=-45.0, keep_leading_ms=20, keep_trailing_ms=80,
+                 target_db=-20.0, max_gain_db=12.0, peak_limit=0.95, trim=True, normalize=True):
+        self.frame_ms = frame_ms
+        self.silence_db = silence_db
+        self.keep_leading_ms = keep_leading_ms
+        # Sentences are queued back to back in streaming mode, so this is the pause left between them
+        self.keep_trailing_ms = keep_trailing_ms
+        self.target_db = target_db
+        self.max_gain_db = max_gain_db
+        self.peak_limit = peak_limit
+        self.trim = trim
+        self.normalize = normalize
+
+    def frame_levels(self, samples, sample_rate):
+        """Returns the level of each frame_ms frame in dBFS, plus the frame length in samples."""
+        frame_length = max(1, sample_rate * self.frame_ms // 1000)
+        num_frames = len(samples) // frame_length
+        if num_frames == 0:
+            return np.zeros(0, dtype=np.float32), frame_length
+        frames = samples[:num_frames * frame_length].reshape(num_frames, frame_length * samples.shape[1])
+        frames = frames.astype(np.float32) / 32768.0
+        return 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10), frame_length
+
+    def process(self, samples, sample_rate):
+        """Returns the trimmed and normalized samples; a view of samples if only trimming was needed."""
+        levels, frame_length = self.frame_levels(samples, sample_rate)
+        voiced = np.flatnonzero(levels > self.silence_db)
+        if len(voiced) == 0:
+            # Nothing but silence; leave it alone rather than dropping the clip
+            return samples
+
+        if self.trim:
+            start = max(0, voiced[0] * frame_length - sample_rate * self.keep_leading_ms // 1000)
+            end = min(len(samples), (voiced[-1] + 1) * frame_length + sample_rate * self.keep_trailing_ms // 1000)
+            samples = samples[start:end]
+
+        if self.normalize:
+            # Mean power over the voiced frames, i.e. a gated RMS
+            loudness_db = 10.0 * np.log10(np.mean(np.power(10.0, levels[voiced] / 10.0)))
+            peak = np.abs(samples).max() / 32768.0
+            gain_db = min(self.target_db - loudness_db, self.max_gain_db)
+            if peak > 0:
+                gain_db = min(gain_db, 20.0 * np.log10(self.peak_limit / peak))
+            if abs(gain_db) > 0.1:
+                gain = np.float32(10.0 ** (gain_db / 20.0))
+                samples = np.clip(samples * gain, -32768, 32767).astype(np.int16)
+        return samples
+
+    def process_pcm(self, pcm, sample_rate, channels):
+        """process() for raw 16-bit PCM bytes; returns bytes or a buffer over the original ones."""
+        samples = np.frombuffer(pcm, dtype='<i2').reshape(-1, channels)
+        processed = self.process(samples, sample_rate)
+        if processed.base is not None and processed.dtype == np.int16 and processed.flags.c_contiguous:
+            # A plain trim is a slice of the original buffer, so no copy is needed
+            return memoryview(processed).cast('B')
+        return np.ascontiguousarray(processed).tobytes()
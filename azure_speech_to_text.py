@@ -1,42 +1,193 @@
 import time
-import azure.cognitiveservices.speech as speechsdk
+import queue
+import threading
 import keyboard
 import os
 from custom_errors import AIAssistantError
+from microphone import MicrophoneCapture
+from vad import EnergyVAD
+from tracing import tracer
+
+speechsdk = None  # azure.cognitiveservices.speech is slow to import, so it is loaded by initialize()
+
+def _import_speechsdk():
+    global speechsdk
+    if speechsdk is None:
+        import azure.cognitiveservices.speech
+        speechsdk = azure.cognitiveservices.speech
+
+def transcribe_continuous(recognizer, timeout=None, on_final=None):
+    """Runs continuous recognition until the recognizer's audio ends, and returns the joined text.
+
+    Completion is signalled by the session_stopped/canceled events rather than polled.
+    Anything with the SpeechRecognizer event/start/stop interface can be passed in.
+    """
+    done = threading.Event()
+    all_results = []
+    errors = []
+
+    def handle_final_result(evt):
+        if evt.result.text:
+            all_results.append(evt.result.text)
+            if on_final:
+                on_final(evt.result.text)
+
+    def stop_cb(evt):
+        cancellation_details = getattr(evt, 'cancellation_details', None)
+        if cancellation_details is not None and speechsdk is not None and cancellation_details.reason == speechsdk.CancellationReason.Error:
+            errors.append(cancellation_details.error_details)
+        done.set()
+
+    recognizer.recognized.connect(handle_final_result)
+    recognizer.session_stopped.connect(stop_cb)
+    recognizer.canceled.connect(stop_cb)
+
+    with tracer.span("stt.transcribe"):
+        recognizer.start_continuous_recognition()
+        try:
+            if not done.wait(timeout):
+                raise AIAssistantError(f"Speech recognition didn't finish within {timeout} seconds")
+        finally:
+            recognizer.stop_continuous_recognition()
+
+    if errors:
+        raise AIAssistantError(f"Speech recognition canceled: {errors[0]}")
+    return " ".join(all_results).strip()
+
+class RecognizerSession:
+    """A SpeechRecognizer whose callbacks are connected once and which is reused turn after turn.
+
+    Each turn passes a dict of handlers ('recognizing', 'recognized', 'stopped') to start();
+    the permanent callbacks forward events to whichever handlers are current. Between turns
+    the service connection is re-opened in advance so the next start() doesn't pay for it.
+    """
+
+    def __init__(self, speech_config, audio_config, push_stream=None):
+        self.audio_config = audio_config
+        self.push_stream = push_stream
+        self.recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+        self.connection = speechsdk.Connection.from_recognizer(self.recognizer)
+        self.stopped = threading.Event()
+        self.last_setup_ms = None
+        self._handlers = {}
+
+        self.recognizer.recognizing.connect(lambda evt: self._dispatch('recognizing', evt))
+        self.recognizer.recognized.connect(lambda evt: self._dispatch('recognized', evt))
+        self.recognizer.session_stopped.connect(self._on_stopped)
+        self.recognizer.canceled.connect(self._on_stopped)
+
+    def _dispatch(self, name, evt):
+        handler = self._handlers.get(name)
+        if handler:
+            handler(evt)
+
+    def _on_stopped(self, evt):
+        self.stopped.set()
+        self._dispatch('stopped', evt)
+
+    def preconnect(self):
+        try:
+            self.connection.open(True)
+        except Exception as e:
+            print(f"Couldn't pre-open the speech recognition connection: {str(e)}")
+
+    def start(self, handlers):
+        """Starts continuous recognition for a new turn and returns how long setup took in ms."""
+        self._handlers = handlers
+        self.stopped.clear()
+        start_time = time.perf_counter()
+        with tracer.span("stt.setup"):
+            self.recognizer.start_continuous_recognition_async().get()
+        self.last_setup_ms = (time.perf_counter() - start_time) * 1000
+        return self.last_setup_ms
+
+    def stop(self):
+        """Stops recognition, flushing the final phrase, and gets ready for the next turn."""
+        try:
+            with tracer.span("stt.finalize"):
+                self.recognizer.stop_continuous_recognition_async().get()
+        finally:
+            self._handlers = {}
+            self.preconnect()
 
 class SpeechToTextManager:
-    def __init__(self):
+    def __init__(self, prewarm_recognizers=True):
         self.azure_speechconfig = None
         self.azure_audioconfig = None
         self.azure_speechrecognizer = None
+        self.prewarm_recognizers = prewarm_recognizers
+        self._mic_session = None
+        self._push_session = None
 
     def initialize(self):
         try:
+            _import_speechsdk()
             self.azure_speechconfig = speechsdk.SpeechConfig(
                 subscription=os.environ['AZURE_TTS_KEY'],
                 region=os.environ['AZURE_TTS_REGION']
             )
             self.azure_speechconfig.speech_recognition_language = "en-US"
+            # Finalize a phrase after half a second of silence, so endpointed turns have their text
+            # by the time the local voice activity detector ends the turn
+            self.azure_speechconfig.set_property_by_name("Speech_SegmentationSilenceTimeoutMs", "500")
         except KeyError as e:
             raise AIAssistantError(f"Missing environment variable: {str(e)}")
         except Exception as e:
             raise AIAssistantError(f"Error initializing Azure Speech SDK: {str(e)}")
 
+        if self.prewarm_recognizers:
+            self.prepare_sessions()
+
+    def prepare_sessions(self):
+        """Builds the microphone and push-stream recognizers and opens their connections ahead of the first turn."""
+        self._ensure_initialized()
+        try:
+            if not self._mic_session:
+                self._mic_session = RecognizerSession(
+                    self.azure_speechconfig, speechsdk.audio.AudioConfig(use_default_microphone=True)
+                )
+                self._mic_session.preconnect()
+            if not self._push_session:
+                stream_format = speechsdk.audio.AudioStreamFormat(samples_per_second=16000, bits_per_sample=16, channels=1)
+                push_stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+                self._push_session = RecognizerSession(
+                    self.azure_speechconfig, speechsdk.audio.AudioConfig(stream=push_stream), push_stream
+                )
+                self._push_session.preconnect()
+        except Exception as e:
+            raise AIAssistantError(f"Error preparing speech recognizers: {str(e)}")
+
     def cleanup(self):
-        pass
+        for session in (self._mic_session, self._push_session):
+            if session and session.push_stream:
+                session.push_stream.close()
+        self._mic_session = None
+        self._push_session = None
 
     def _ensure_initialized(self):
         if not self.azure_speechconfig:
             self.initialize()
 
+    def _mic_recognizer_session(self):
+        if not self._mic_session:
+            self.prepare_sessions()
+        self.azure_speechrecognizer = self._mic_session.recognizer
+        return self._mic_session
+
+    def _push_recognizer_session(self):
+        if not self._push_session:
+            self.prepare_sessions()
+        self.azure_speechrecognizer = self._push_session.recognizer
+        return self._push_session
+
     def speechtotext_from_mic(self):
         self._ensure_initialized()
-        self.azure_audioconfig = speechsdk.audio.AudioConfig(use_default_microphone=True)
-        self.azure_speechrecognizer = speechsdk.SpeechRecognizer(speech_config=self.azure_speechconfig, audio_config=self.azure_audioconfig)
+        session = self._mic_recognizer_session()
 
         print("Speak into your microphone.")
         try:
-            speech_recognition_result = self.azure_speechrecognizer.recognize_once_async().get()
+            speech_recognition_result = session.recognizer.recognize_once_async().get()
+            session.preconnect()
             text_result = speech_recognition_result.text
 
             if speech_recognition_result.reason == speechsdk.ResultReason.RecognizedSpeech:
@@ -77,71 +228,123 @@ class SpeechToTextManager:
         except Exception as e:
             raise AIAssistantError(f"Error in speech-to-text conversion from file: {str(e)}")
 
-    def speechtotext_from_file_continuous(self, filename):
+    def recognizer_for_file(self, filename):
         self._ensure_initialized()
-        self.azure_audioconfig = speechsdk.audio.AudioConfig(filename=filename)
-        self.azure_speechrecognizer = speechsdk.SpeechRecognizer(speech_config=self.azure_speechconfig, audio_config=self.azure_audioconfig)
-
-        done = False
-        def stop_cb(evt):
-            print('CLOSING on {}'.format(evt))
-            nonlocal done
-            done = True
-
-        all_results = []
-        def handle_final_result(evt):
-            all_results.append(evt.result.text)
+        audio_config = speechsdk.audio.AudioConfig(filename=filename)
+        return speechsdk.SpeechRecognizer(speech_config=self.azure_speechconfig, audio_config=audio_config)
 
-        self.azure_speechrecognizer.recognized.connect(handle_final_result)
-        self.azure_speechrecognizer.session_stopped.connect(stop_cb)
-        self.azure_speechrecognizer.canceled.connect(stop_cb)
+    def speechtotext_from_file_continuous(self, filename):
+        self.azure_speechrecognizer = self.recognizer_for_file(filename)
 
         print("Now processing the audio file...")
-        self.azure_speechrecognizer.start_continuous_recognition()
-        
-        try:
-            while not done:
-                time.sleep(.5)
-        finally:
-            self.azure_speechrecognizer.stop_continuous_recognition()
-
-        final_result = " ".join(all_results).strip()
+        final_result = transcribe_continuous(self.azure_speechrecognizer)
         print(f"\n\nHere's the result we got from continuous file read!\n\n{final_result}\n\n")
         return final_result
 
-    def speechtotext_from_mic_continuous(self, stop_key='p'):
+    def speechtotext_from_mic_continuous(self, stop_key='p', stop_event=None, on_partial=None, on_final=None):
+        """Listens until stop_event is set, or until stop_key is pressed if no stop_event is given.
+
+        The AssistantEngine passes an event that its HotkeyDispatcher sets; standalone callers
+        get a keyboard hook on stop_key. Either way nothing polls the keyboard. on_partial gets
+        every interim hypothesis and on_final every recognized phrase as they arrive.
+        """
         self._ensure_initialized()
-        self.azure_speechrecognizer = speechsdk.SpeechRecognizer(speech_config=self.azure_speechconfig)
+        session = self._mic_recognizer_session()
 
-        done = False
         all_results = []
+        stop_requested = stop_event or threading.Event()
+
+        def recognizing_cb(evt):
+            if on_partial and evt.result.text:
+                on_partial(evt.result.text)
 
         def recognized_cb(evt):
             print('RECOGNIZED: {}'.format(evt))
             all_results.append(evt.result.text)
+            if on_final and evt.result.text:
+                on_final(evt.result.text)
 
         def stop_cb(evt):
             print('CLOSING speech recognition on {}'.format(evt))
-            nonlocal done
-            done = True
+            stop_requested.set()
 
-        self.azure_speechrecognizer.recognized.connect(recognized_cb)
-        self.azure_speechrecognizer.session_stopped.connect(stop_cb)
-        self.azure_speechrecognizer.canceled.connect(stop_cb)
-
-        result_future = self.azure_speechrecognizer.start_continuous_recognition_async()
-        result_future.get()  # wait for initialization to complete
-        print('Continuous Speech Recognition is now running, say something.')
+        # The recognizer and its connection already exist, so this only starts the audio flowing
+        setup_ms = session.start({'recognizing': recognizing_cb, 'recognized': recognized_cb, 'stopped': stop_cb})
+        print(f'Continuous Speech Recognition is now running ({setup_ms:.0f} ms setup), say something.')
 
+        hotkey = None
         try:
-            while not done:
-                if keyboard.read_key() == stop_key:
-                    print("\nEnding azure speech recognition\n")
-                    self.azure_speechrecognizer.stop_continuous_recognition_async()
-                    break
+            if stop_event is None:
+                hotkey = keyboard.add_hotkey(stop_key, stop_requested.set)
+            with tracer.span("stt.capture"):
+                stop_requested.wait()
+            print("\nEnding azure speech recognition\n")
         except Exception as e:
             raise AIAssistantError(f"Error in continuous speech-to-text conversion: {str(e)}")
         finally:
+            if hotkey is not None:
+                keyboard.remove_hotkey(hotkey)
+            # Waits for the last phrase to be flushed into all_results
+            session.stop()
             final_result = " ".join(all_results).strip()
             print(f"\n\nHere's the result we got!\n\n{final_result}\n\n")
             return final_result
+
+    def speechtotext_from_mic_endpointed(self, silence_ms=700, max_seconds=60, on_partial=None, on_final=None, stop_event=None):
+        """Listens until a local voice activity detector hears silence_ms of silence after speech.
+
+        Microphone audio is pushed to the recognizer and to the detector at the same time.
+        on_partial gets every interim hypothesis and on_final every recognized phrase as soon
+        as Azure produces them. Setting stop_event ends the turn straight away, e.g. from the
+        stop hotkey.
+        """
+        self._ensure_initialized()
+        session = self._push_recognizer_session()
+        vad = EnergyVAD(sample_rate=16000, silence_ms=silence_ms)
+        microphone = MicrophoneCapture(sample_rate=16000)
+        all_results = []
+
+        def recognizing_cb(evt):
+            if on_partial and evt.result.text:
+                on_partial(evt.result.text)
+
+        def recognized_cb(evt):
+            if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech and evt.result.text:
+                all_results.append(evt.result.text)
+                if on_final:
+                    on_final(evt.result.text)
+
+        try:
+            setup_ms = session.start({'recognizing': recognizing_cb, 'recognized': recognized_cb})
+            microphone.open()
+            print(f'Listening ({setup_ms:.0f} ms setup), say something. The turn ends automatically when you stop talking.')
+
+            deadline = time.monotonic() + max_seconds
+            with tracer.span("stt.capture"):
+                while time.monotonic() < deadline and not session.stopped.is_set():
+                    if stop_event is not None and stop_event.is_set():
+                        print("\nEnding azure speech recognition\n")
+                        break
+                    try:
+                        frame = microphone.frames.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if frame is None:
+                        break
+                    session.push_stream.write(frame)
+                    if vad.process(frame):
+                        print("\nSilence detected, ending azure speech recognition\n")
+                        break
+        except AIAssistantError:
+            raise
+        except Exception as e:
+            raise AIAssistantError(f"Error in endpointed speech-to-text conversion: {str(e)}")
+        finally:
+            microphone.close()
+            # The trailing silence has already been pushed, so Azure has finalized the last phrase;
+            # stopping flushes anything left without closing the stream, which is reused next turn
+            session.stop()
+
+        final_result = " ".join(all_results).strip()
+        print(f"\n\nHere's the result we got!\n\n{final_result}\n\n")
+        return final_result
@@ -0,0 +1,92 @@
+"""Transcribe many audio files at once with a bounded pool of Azure recognizers.
+
+Usage:
+    python batch_transcribe.py VODS_DIR clip1.wav clip2.wav --workers 4 --output transcripts.jsonl
+
+One JSON object per file is written as soon as that file is done:
+    {"file": ..., "text": ..., "seconds": ..., "error": null}
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rich import print
+from custom_errors import AIAssistantError
+from azure_speech_to_text import SpeechToTextManager, transcribe_continuous
+
+# AudioConfig(filename=...) reads PCM WAV; other containers need a compressed stream format
+AUDIO_EXTENSIONS = ('.wav',)
+
+def collect_audio_files(paths, extensions=AUDIO_EXTENSIONS):
+    """Expands directories (recursively) into the audio files they contain, keeping the given order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(extensions))
+        else:
+            files.append(path)
+    return files
+
+def transcribe_file(recognizer_factory, filename, timeout=None):
+    start_time = time.perf_counter()
+    record = {"file": filename, "text": "", "seconds": None, "error": None}
+    try:
+        record["text"] = transcribe_continuous(recognizer_factory(filename), timeout=timeout)
+    except AIAssistantError as e:
+        record["error"] = str(e)
+    except Exception as e:
+        record["error"] = f"Error transcribing {filename}: {str(e)}"
+    record["seconds"] = round(time.perf_counter() - start_time, 3)
+    return record
+
+def transcribe_batch(files, recognizer_factory, output, workers=4, timeout=None):
+    """Transcribes files on at most `workers` recognizers at a time and streams JSONL records to output.
+
+    recognizer_factory(filename) must return a SpeechRecognizer (or a stand-in with the same
+    events and start/stop methods) reading that file. Returns the list of records in
+    completion order.
+    """
+    records = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transcribe") as executor:
+        futures = [executor.submit(transcribe_file, recognizer_factory, filename, timeout) for filename in files]
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+    return records
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcribe audio files or directories of them to JSONL.")
+    parser.add_argument("paths", nargs="+", help="audio files or directories to scan for .wav files")
+    parser.add_argument("--workers", type=int, default=4, help="number of recognizers running at once")
+    parser.add_argument("--output", default="-", help="JSONL file to write, or - for stdout")
+    parser.add_argument("--timeout", type=float, default=None, help="give up on a file after this many seconds")
+    args = parser.parse_args(argv)
+
+    files = collect_audio_files(args.paths)
+    if not files:
+        print("[yellow]No audio files found.[/yellow]", file=sys.stderr)
+        return 1
+
+    speech_to_text = SpeechToTextManager(prewarm_recognizers=False)
+    speech_to_text.initialize()
+
+    start_time = time.perf_counter()
+    output = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    try:
+        records = transcribe_batch(files, speech_to_text.recognizer_for_file, output, args.workers, args.timeout)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    failed = sum(1 for record in records if record["error"])
+    print(f"[green]Transcribed {len(records) - failed}/{len(records)} files in {time.perf_counter() - start_time:.1f}s "
+          f"with {args.workers} workers.[/green]", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
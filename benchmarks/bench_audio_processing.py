@@ -0,0 +1,66 @@
+"""Measures what AudioPostProcessor costs per second of audio, and what it trims.
+
+Clips are synthetic speech-like bursts with leading and trailing silence, like the ones
+ElevenLabs returns. Run from the repository root:
+    python benchmarks/bench_audio_processing.py --seconds 1 5 30 --rates 22050 44100
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio_processing import AudioPostProcessor
+
+def make_clip(seconds, sample_rate, channels=1, leading_silence=0.3, trailing_silence=0.4, level=0.05, seed=0):
+    """Syllable-length bursts of a harmonic tone over a faint noise floor, padded with silence."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    voiced = np.sin(2 * np.pi * 140 * t) + 0.5 * np.sin(2 * np.pi * 280 * t) + 0.25 * np.sin(2 * np.pi * 420 * t)
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)  # Four syllables a second
+    speech = level * voiced * envelope
+    silence = lambda duration: np.zeros(int(duration * sample_rate))
+    signal = np.concatenate([silence(leading_silence), speech, silence(trailing_silence)])
+    signal += rng.normal(0, 1e-4, len(signal))  # Noise floor well below the silence threshold
+    samples = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    return np.repeat(samples[:, None], channels, axis=1)
+
+def timed(function, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def rms_db(samples):
+    samples = samples.astype(np.float32) / 32768.0
+    return 10 * np.log10(np.mean(samples * samples) + 1e-10)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, nargs="+", default=[1, 5, 30])
+    parser.add_argument("--rates", type=int, nargs="+", default=[22050, 44100])
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    processor = AudioPostProcessor()
+    print(f"{'rate':>6} {'seconds':>8} {'trim ms':>8} {'full ms':>8} {'us per s':>9} {'trimmed ms':>11} {'dB before':>10} {'dB after':>9}")
+    for sample_rate in args.rates:
+        for seconds in args.seconds:
+            clip = make_clip(seconds, sample_rate, args.channels)
+            pcm = clip.tobytes()
+            trim_only = AudioPostProcessor(normalize=False)
+            trim_seconds = timed(lambda: trim_only.process_pcm(pcm, sample_rate, args.channels), args.repeats)
+            full_seconds = timed(lambda: processor.process_pcm(pcm, sample_rate, args.channels), args.repeats)
+            processed = processor.process(clip, sample_rate)
+            audio_seconds = len(clip) / sample_rate
+            trimmed_ms = (len(clip) - len(processed)) / sample_rate * 1000
+            print(f"{sample_rate:>6} {audio_seconds:>8.2f} {trim_seconds * 1000:>8.3f} {full_seconds * 1000:>8.3f} "
+                  f"{full_seconds / audio_seconds * 1e6:>9.1f} {trimmed_ms:>11.0f} {rms_db(clip):>10.1f} {rms_db(processed):>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Runs N simulated turns through the real managers with local fakes for Azure, OpenAI and ElevenLabs.
+
+Each turn transcribes a (fake) recording, asks chat_with_history, synthesizes the answer
+with text_to_audio and plays it through AudioManager on the dummy SDL audio driver, or with
+--streaming runs StreamingPipeline instead of the last three steps. Throughput, per-step
+latency from tracing.py and memory are reported at the end.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --turns 20
+    python benchmarks/bench_pipeline.py --turns 20 --streaming --tokens-per-second 30 --json results.json
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+for name in ("OPENAI_API_KEY", "ELEVENLABS_API_KEY", "AZURE_TTS_KEY", "AZURE_TTS_REGION"):
+    os.environ.setdefault(name, "fake")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--streaming", action="store_true", help="speak sentence by sentence with StreamingPipeline")
+    parser.add_argument("--stt-latency", type=float, default=0.3, help="seconds until the final transcript")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="seconds until the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--answer-tokens", type=int, default=40)
+    parser.add_argument("--tts-latency", type=float, default=0.25, help="seconds per ElevenLabs request")
+    parser.add_argument("--audio-seconds", type=float, default=0.5, help="length of each synthesized clip")
+    parser.add_argument("--tts-format", choices=("pcm", "mp3"), default="pcm",
+                        help="ask ElevenLabs for raw PCM at the playback rate, or for MP3 that has to be decoded")
+    parser.add_argument("--fake-tokenizer", action="store_true",
+                        help="approximate token counts instead of loading tiktoken (used automatically offline)")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report Python heap usage; slows the run down")
+    parser.add_argument("--json", help="write the results to this file as well")
+    return parser.parse_args()
+
+def run_turn(resource_manager, index, streaming, voice):
+    from streaming_pipeline import StreamingPipeline
+
+    prompt = resource_manager.speech_to_text.speechtotext_from_file_continuous(f"question-{index}.wav")
+    if streaming:
+        return StreamingPipeline(resource_manager, voice).run(prompt)
+    answer = resource_manager.openai.chat_with_history(prompt)
+    audio_file = resource_manager.eleven_labs.text_to_audio(answer, voice, False)
+    resource_manager.audio.play_audio(audio_file, True, False, True)
+    return answer
+
+def main():
+    args = parse_args()
+    config = fakes.FakeConfig(stt_latency=args.stt_latency, llm_first_token_latency=args.llm_latency,
+                              tokens_per_second=args.tokens_per_second, answer_tokens=args.answer_tokens,
+                              tts_latency=args.tts_latency, audio_seconds=args.audio_seconds)
+    fake_tokenizer = args.fake_tokenizer or not fakes.real_tiktoken_available()
+    if fake_tokenizer:
+        print("tiktoken's cl100k_base is not available, token counts are approximated.")
+
+    server = fakes.FakeElevenLabsServer(config).start()
+    fakes.install(config, server.base_url, fake_tokenizer=fake_tokenizer)
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    # The TTS cache, voice catalogue and any audio files go to a scratch directory
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.chdir(work_dir)
+
+    from resource_manager import ResourceManager
+    from tracing import tracer
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    # Answers are unique per turn, so the response cache would only add lookups
+    resource_manager = ResourceManager(warm_up_when_idle=False, cache_responses=False, tts_output_format=args.tts_format)
+    startup_start = time.perf_counter()
+    resource_manager.initialize()
+    for name in ResourceManager.BACKENDS:
+        getattr(resource_manager, name)
+    startup_seconds = time.perf_counter() - startup_start
+
+    tracer.enable(os.path.join(work_dir, "trace.jsonl"))
+    turn_seconds = []
+    errors = 0
+    run_start = time.perf_counter()
+    try:
+        for index in range(args.turns):
+            tracer.set_turn(index + 1)
+            turn_start = time.perf_counter()
+            try:
+                run_turn(resource_manager, index + 1, args.streaming, "Aaryan")
+            except Exception as e:
+                errors += 1
+                print(f"Turn {index + 1} failed: {str(e)}")
+            turn_seconds.append(time.perf_counter() - turn_start)
+            tracer.record("turn.total", turn_seconds[-1])
+    finally:
+        run_seconds = time.perf_counter() - run_start
+        tracer.export_chrome_trace(os.path.join(work_dir, "trace.chrome.json"))
+        tracer.disable()
+        heap = tracemalloc.get_traced_memory() if args.tracemalloc else None
+        resource_manager.cleanup()
+        server.stop()
+
+    results = {
+        "mode": "streaming" if args.streaming else "sequential",
+        "tts_format": resource_manager.eleven_labs.output_format,
+        "turns": args.turns,
+        "errors": errors,
+        "startup_seconds": round(startup_seconds, 4),
+        "turns_per_minute": round(args.turns / run_seconds * 60, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stages": {name: {key: round(value, 4) if isinstance(value, float) else value for key, value in stats.items()}
+                   for name, stats in tracer.summary().items()},
+    }
+    if heap:
+        results["heap_current_mb"] = round(heap[0] / 2 ** 20, 2)
+        results["heap_peak_mb"] = round(heap[1] / 2 ** 20, 2)
+
+    print(f"\n{results['turns']} {results['mode']} turns ({results['tts_format']}), {errors} failed, {results['turns_per_minute']} turns/min, "
+          f"startup {startup_seconds * 1000:.0f} ms, max RSS {results['max_rss_mb']} MB"
+          + (f", heap peak {results['heap_peak_mb']} MB" if heap else ""))
+    print(f"{'step':<20} {'count':>6} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, stats in results["stages"].items():
+        print(f"{name:<20} {stats['count']:>6} {stats['p50'] * 1000:>9.1f} {stats['p95'] * 1000:>9.1f}")
+    print(f"Trace files are in {work_dir}")
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Compares the shared-encoder, batched and memoized token counting against the old per-call version.
+
+The numbers only mean something with the real cl100k_base encoding, so there is no
+stand-in tokenizer here. tiktoken downloads the file on first use; on a machine
+without network access, pass a local copy of cl100k_base.tiktoken with --encoding-file.
+Run from the repository root:
+    python benchmarks/bench_token_counting.py --sizes 10 100 1000 10000
+    python benchmarks/bench_token_counting.py --encoding-file ~/cl100k_base.tiktoken
+"""
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import tiktoken
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import openai_chat
+from openai_chat import num_tokens_from_messages
+
+WORDS = ("the stream chat game viewer question answer assistant today really think about "
+         "voice music level boss favourite play again what why how when twitch subscribe").split()
+
+CL100K_BASE_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+CL100K_BASE_SHA256 = "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7"
+
+def use_local_encoding_file(path):
+    """Makes tiktoken load cl100k_base from path instead of downloading it.
+
+    The file is placed in a fresh TIKTOKEN_CACHE_DIR under the name tiktoken looks it up by.
+    Its hash is checked first, so the counts are those of the real encoding.
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    if digest != CL100K_BASE_SHA256:
+        raise ValueError(f"{path} is not cl100k_base.tiktoken (sha256 {digest})")
+    cache_dir = tempfile.mkdtemp(prefix="tiktoken-cache-")
+    shutil.copyfile(path, os.path.join(cache_dir, hashlib.sha1(CL100K_BASE_URL.encode()).hexdigest()))
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+
+def legacy_num_tokens_from_messages(messages, model='gpt-4'):
+    """The previous implementation: looks the encoding up and encodes field by field on every call."""
+    encoding = tiktoken.encoding_for_model(model)
+    num_tokens = 0
+    for message in messages:
+        num_tokens += 4
+        for key, value in message.items():
+            num_tokens += len(encoding.encode(value))
+            if key == "name":
+                num_tokens += -1
+    return num_tokens + 2
+
+def make_history(size, seed=0):
+    rng = random.Random(seed)
+    return [{"role": "user" if i % 2 == 0 else "assistant",
+             "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 60))) + f" ({i})"}
+            for i in range(size)]
+
+def timed(function, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--encoding-file", help="local copy of cl100k_base.tiktoken, for running without network access")
+    args = parser.parse_args()
+
+    try:
+        if args.encoding_file:
+            use_local_encoding_file(args.encoding_file)
+        openai_chat.warm_up_encodings()
+    except Exception as e:
+        parser.exit(1, f"Couldn't load the cl100k_base encoding, so nothing was measured: {e}\n"
+                       "Run with network access or pass --encoding-file.\n")
+
+    # Large enough that the warm runs are served entirely from the memo
+    openai_chat.MEMO_MAX_ENTRIES = max(openai_chat.MEMO_MAX_ENTRIES, max(args.sizes))
+
+    print(f"{'messages':>9} {'legacy ms':>10} {'batch cold ms':>14} {'memo warm ms':>13} {'speedup':>8}")
+    for size in args.sizes:
+        history = make_history(size)
+        legacy_seconds, legacy_tokens = timed(lambda: legacy_num_tokens_from_messages(history), args.repeats)
+
+        def cold():
+            openai_chat._token_memo.clear()
+            return num_tokens_from_messages(history)
+        cold_seconds, tokens = timed(cold, args.repeats)
+        warm_seconds, _ = timed(lambda: num_tokens_from_messages(history), args.repeats)
+
+        assert tokens == legacy_tokens, (tokens, legacy_tokens)
+        print(f"{size:>9} {legacy_seconds * 1000:>10.2f} {cold_seconds * 1000:>14.2f} {warm_seconds * 1000:>13.2f} "
+              f"{legacy_seconds / cold_seconds:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Local stand-ins for the Azure Speech SDK, the OpenAI client, ElevenLabs and tiktoken.
+
+install() puts fake modules into sys.modules before the managers import them, so the
+real ResourceManager and managers run unchanged without keys or network access. ElevenLabs
+is served by a local HTTP server, because ElevenLabsManager talks to the REST API through
+the shared requests session; the fake elevenlabs module covers the SDK calls that are left.
+"""
+import io
+import json
+import re
+import socket
+import sys
+import threading
+import time
+import types
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+class FakeConfig:
+    """Latencies are in seconds. The answer has answer_tokens tokens streamed at tokens_per_second."""
+
+    def __init__(self, stt_latency=0.3, llm_first_token_latency=0.4, tokens_per_second=60.0, answer_tokens=40,
+                 tts_latency=0.25, audio_seconds=0.5, audio_sample_rate=44100):
+        self.stt_latency = stt_latency
+        self.llm_first_token_latency = llm_first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.tts_latency = tts_latency
+        self.audio_seconds = audio_seconds
+        self.audio_sample_rate = audio_sample_rate
+
+def make_pcm(seconds, sample_rate=44100, frequency=220.0):
+    """A mono sine tone as raw 16-bit little-endian samples, like ElevenLabs' pcm_<rate> output."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (0.2 * np.sin(2 * np.pi * frequency * t) * 32767).astype('<i2')
+
+def make_mp3(seconds, sample_rate=44100, frequency=220.0):
+    """A sine tone encoded as MP3, like ElevenLabs' default mp3_44100_128 output."""
+    import soundfile as sf
+    samples = make_pcm(seconds, sample_rate, frequency)
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format='MP3')
+    return buffer.getvalue()
+
+# --- Azure Speech SDK ---
+
+class _EventSignal:
+    def __init__(self):
+        self._callbacks = []
+
+    def connect(self, callback):
+        self._callbacks.append(callback)
+
+    def fire(self, evt):
+        for callback in list(self._callbacks):
+            callback(evt)
+
+class _Future:
+    def __init__(self, value=None):
+        self._value = value
+
+    def get(self):
+        return self._value
+
+def _speech_module(config):
+    speechsdk = types.ModuleType("azure.cognitiveservices.speech")
+    audio = types.ModuleType("azure.cognitiveservices.speech.audio")
+    speechsdk.audio = audio
+
+    class ResultReason:
+        RecognizedSpeech = "RecognizedSpeech"
+        RecognizingSpeech = "RecognizingSpeech"
+        NoMatch = "NoMatch"
+        Canceled = "Canceled"
+
+    class CancellationReason:
+        Error = "Error"
+        EndOfStream = "EndOfStream"
+
+    class SpeechConfig:
+        def __init__(self, subscription=None, region=None):
+            self.speech_recognition_language = None
+            self.properties = {}
+
+        def set_property_by_name(self, name, value):
+            self.properties[name] = value
+
+    class AudioConfig:
+        def __init__(self, use_default_microphone=False, filename=None, stream=None):
+            self.filename = filename
+            self.stream = stream
+
+    class AudioStreamFormat:
+        def __init__(self, samples_per_second=16000, bits_per_sample=16, channels=1):
+            pass
+
+    class PushAudioInputStream:
+        def __init__(self, stream_format=None):
+            self.bytes_written = 0
+
+        def write(self, data):
+            self.bytes_written += len(data)
+
+        def close(self):
+            pass
+
+    class SpeechRecognizer:
+        """Recognizes one phrase per session after config.stt_latency, named after the audio file."""
+
+        def __init__(self, speech_config=None, audio_config=None):
+            self.audio_config = audio_config
+            self.recognizing = _EventSignal()
+            self.recognized = _EventSignal()
+            self.session_started = _EventSignal()
+            self.session_stopped = _EventSignal()
+            self.canceled = _EventSignal()
+            self._stop = threading.Event()
+            self._thread = None
+
+        def _text(self):
+            filename = getattr(self.audio_config, 'filename', None) or "the microphone"
+            return f"What do you think about {filename.rsplit('.', 1)[0].replace('-', ' ')}?"
+
+        def _event(self, reason, text):
+            return types.SimpleNamespace(result=types.SimpleNamespace(reason=reason, text=text), cancellation_details=None)
+
+        def _run(self):
+            text = self._text()
+            words = text.split()
+            # Interim hypotheses arrive while the phrase is spoken, the final one once it ends
+            for i in range(1, len(words) + 1):
+                if self._stop.wait(config.stt_latency / (len(words) + 1)):
+                    break
+                self.recognizing.fire(self._event(ResultReason.RecognizingSpeech, " ".join(words[:i])))
+            if not self._stop.wait(config.stt_latency / (len(words) + 1)):
+                self.recognized.fire(self._event(ResultReason.RecognizedSpeech, text))
+            self.session_stopped.fire(types.SimpleNamespace(cancellation_details=None))
+
+        def start_continuous_recognition(self):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="fake-recognizer", daemon=True)
+            self._thread.start()
+
+        def stop_continuous_recognition(self):
+            self._stop.set()
+            if self._thread:
+                self._thread.join()
+                self._thread = None
+
+        def start_continuous_recognition_async(self):
+            self.start_continuous_recognition()
+            return _Future()
+
+        def stop_continuous_recognition_async(self):
+            self.stop_continuous_recognition()
+            return _Future()
+
+        def recognize_once_async(self):
+            time.sleep(config.stt_latency)
+            return _Future(types.SimpleNamespace(reason=ResultReason.RecognizedSpeech, text=self._text()))
+
+    class Connection:
+        @classmethod
+        def from_recognizer(cls, recognizer):
+            return cls()
+
+        def open(self, for_continuous_recognition):
+            pass
+
+        def close(self):
+            pass
+
+    speechsdk.ResultReason = ResultReason
+    speechsdk.CancellationReason = CancellationReason
+    speechsdk.SpeechConfig = SpeechConfig
+    speechsdk.AudioConfig = audio.AudioConfig = AudioConfig
+    audio.AudioStreamFormat = AudioStreamFormat
+    audio.PushAudioInputStream = PushAudioInputStream
+    speechsdk.SpeechRecognizer = SpeechRecognizer
+    speechsdk.Connection = Connection
+    return speechsdk, audio
+
+# --- OpenAI ---
+
+def _answer_tokens(messages, count):
+    question = messages[-1]['content'] if messages else ""
+    words = re.findall(r"\w+", question) or ["that"]
+    # Sentence ends every dozen tokens, so the streaming pipeline has something to chunk
+    return [f" {words[i % len(words)]}" + ("." if i % 12 == 11 else "") for i in range(count)]
+
+def _openai_module(config):
+    openai = types.ModuleType("openai")
+
+    def completion(messages):
+        time.sleep(config.llm_first_token_latency + config.answer_tokens / config.tokens_per_second)
+        message = types.SimpleNamespace(role="assistant", content="".join(_answer_tokens(messages, config.answer_tokens)).strip())
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    def streamed_completion(messages):
+        time.sleep(config.llm_first_token_latency)
+        for token in _answer_tokens(messages, config.answer_tokens):
+            time.sleep(1 / config.tokens_per_second)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=token))])
+
+    class Completions:
+        def create(self, model=None, messages=(), stream=False, **kwargs):
+            return streamed_completion(messages) if stream else completion(messages)
+
+    class OpenAI:
+        def __init__(self, api_key=None, http_client=None):
+            self.chat = types.SimpleNamespace(completions=Completions())
+
+    openai.OpenAI = OpenAI
+    return openai
+
+# --- ElevenLabs ---
+
+class _ElevenLabsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+    audio = b""
+    voices = [{"voice_id": "fake-voice-id", "name": "Aaryan", "category": "premade"}]
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._send(json.dumps({"voices": self.voices}).encode(), "application/json")
+
+    def do_HEAD(self):
+        self._send(b"", "text/plain")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        output_format = parse_qs(urlparse(self.path).query).get("output_format", ["mp3_44100_128"])[0]
+        time.sleep(self.config.tts_latency)
+        if output_format.startswith("pcm_"):
+            self._send(make_pcm(self.config.audio_seconds, int(output_format[len("pcm_"):])).tobytes(), "application/octet-stream")
+        else:
+            self._send(self.audio, "audio/mpeg")
+
+    def log_message(self, *args):
+        pass
+
+class FakeElevenLabsServer:
+    def __init__(self, config):
+        handler = type("Handler", (_ElevenLabsHandler,), {"config": config, "audio": make_mp3(config.audio_seconds, config.audio_sample_rate)})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-elevenlabs", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def _elevenlabs_module(config):
+    elevenlabs = types.ModuleType("elevenlabs")
+    audio = make_mp3(config.audio_seconds, config.audio_sample_rate)
+
+    def generate(text=None, voice=None, model=None, stream=False):
+        time.sleep(config.tts_latency)
+        return iter([audio]) if stream else audio
+
+    def save(audio_bytes, filename):
+        with open(filename, 'wb') as f:
+            f.write(audio_bytes)
+
+    elevenlabs.set_api_key = lambda api_key: None
+    elevenlabs.generate = generate
+    elevenlabs.save = save
+    elevenlabs.Voice = lambda voice_id=None, name=None: types.SimpleNamespace(voice_id=voice_id, name=name)
+    elevenlabs.voices = lambda: [types.SimpleNamespace(**voice) for voice in _ElevenLabsHandler.voices]
+    elevenlabs.play = lambda audio_bytes: None
+    elevenlabs.stream = lambda chunks: b"".join(chunks)
+    return elevenlabs
+
+# --- tiktoken ---
+
+def _tiktoken_module():
+    """Approximates cl100k_base with one token per word or punctuation mark; only used offline."""
+    tiktoken = types.ModuleType("tiktoken")
+    pattern = re.compile(r"\w+|[^\w\s]")
+
+    class Encoding:
+        name = "fake_cl100k_base"
+
+        def encode(self, text, **kwargs):
+            return pattern.findall(text)
+
+        encode_ordinary = encode
+
+        def encode_ordinary_batch(self, texts, num_threads=8):
+            return [self.encode(text) for text in texts]
+
+    tiktoken.encoding_for_model = lambda model: Encoding()
+    return tiktoken
+
+def real_tiktoken_available():
+    try:
+        import tiktoken
+        tiktoken.encoding_for_model('gpt-4')
+        return True
+    except Exception:
+        return False
+
+def install(config, eleven_labs_base_url, fake_tokenizer=False):
+    """Registers the fake SDK modules and points ElevenLabsManager at the local server."""
+    speechsdk, speech_audio = _speech_module(config)
+    azure = types.ModuleType("azure")
+    cognitiveservices = types.ModuleType("azure.cognitiveservices")
+    azure.cognitiveservices = cognitiveservices
+    cognitiveservices.speech = speechsdk
+    sys.modules.update({
+        "azure": azure,
+        "azure.cognitiveservices": cognitiveservices,
+        "azure.cognitiveservices.speech": speechsdk,
+        "azure.cognitiveservices.speech.audio": speech_audio,
+        "openai": _openai_module(config),
+        "elevenlabs": _elevenlabs_module(config),
+    })
+    if fake_tokenizer:
+        sys.modules["tiktoken"] = _tiktoken_module()
+
+    import eleven_labs
+    eleven_labs.ELEVENLABS_BASE_URL = eleven_labs_base_url
@@ -0,0 +1,53 @@
+import threading
+from custom_errors import TurnCancelled
+
+class CancelToken:
+    """Cooperative cancellation for one turn.
+
+    Long-running work either checks cancelled between steps or registers a callback
+    that aborts it from the outside, such as closing an HTTP stream. Callbacks run on
+    the thread that calls cancel(), so they must be quick and must not raise.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error while cancelling: {str(e)}")
+
+    def add_callback(self, callback):
+        """Calls callback() on cancel, or right away if already cancelled."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TurnCancelled("The turn was cancelled.")
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
@@ -0,0 +1,90 @@
+import json
+import os
+import time
+import threading
+
+class ChatJournal:
+    """Append-only JSON-lines log of chat messages.
+
+    Each turn only appends its new messages. fsync is batched: it runs after
+    fsync_every records or fsync_interval seconds, whichever comes first, and on close.
+    A torn last line from a crash is skipped when loading.
+    """
+
+    def __init__(self, path="ChatHistory.jsonl", fsync_every=8, fsync_interval=2.0):
+        self.path = os.path.abspath(path)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._records = 0
+        self._lock = threading.Lock()
+
+    def open(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def load(self):
+        """Returns every complete message in the journal, oldest first."""
+        messages = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        messages.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Only the last line can be torn; anything after it was never acknowledged
+                        break
+        except FileNotFoundError:
+            pass
+        self._records = len(messages)
+        return messages
+
+    def append(self, messages):
+        with self._lock:
+            if not self._file:
+                self.open()
+            self._file.write("".join(json.dumps(message, ensure_ascii=False) + "\n" for message in messages))
+            self._file.flush()
+            self._records += len(messages)
+            self._pending += len(messages)
+            if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._file and self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    @property
+    def record_count(self):
+        return self._records
+
+    def compact(self, messages):
+        """Atomically replaces the journal with just the given messages, e.g. the trimmed live history."""
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write("".join(json.dumps(message, ensure_ascii=False) + "\n" for message in messages))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._records = len(messages)
+            self._pending = 0
+            self._last_sync = time.monotonic()
@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+from rich import print
+
+class ConfigWatcher:
+    """Keeps the parsed AI assistant config and its system message cached, reloading only when the file changes.
+
+    A background thread compares the file's mtime, inode and size. Parsing and
+    validation happen on that thread, so readers just pick up the cached values.
+    """
+
+    def __init__(self, path, poll_interval=0.5):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.config = None
+        self.system_message = None
+        self.version = 0  # Bumped every time a new valid config is loaded
+        self._signature = ()  # Never matches a real signature, so the first check always looks
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_callback(self, callback):
+        """Registers callback(config, system_message), called after each successful reload."""
+        self._callbacks.append(callback)
+
+    def start(self):
+        self.check()
+        self._thread = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def current(self):
+        with self._lock:
+            return self.version, self.system_message
+
+    def _watch(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self.check()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+    def check(self):
+        """Reloads the config if the file changed since the last check. Returns True if a new config was loaded."""
+        signature = self._file_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+
+        if signature is None:
+            if self.version == 0:
+                print("[yellow]No custom configuration found. Using default settings.[/yellow]")
+            return False
+
+        try:
+            with open(self.path, 'r') as f:
+                config = json.load(f)
+            self.validate(config)
+        except FileNotFoundError:
+            return False
+        except json.JSONDecodeError:
+            # The GUI may be midway through writing it; the next change will be picked up
+            print("[red]Error decoding the configuration file. Keeping the previous settings.[/red]")
+            return False
+        except ValueError as e:
+            print(f"[red]Invalid configuration file: {str(e)}. Keeping the previous settings.[/red]")
+            return False
+
+        system_message = {"role": "system", "content": config.get('custom_text', '')}
+        with self._lock:
+            self.config = config
+            self.system_message = system_message
+            self.version += 1
+        print("AI assistant configuration reloaded from file.")
+
+        for callback in self._callbacks:
+            try:
+                callback(config, system_message)
+            except Exception as e:
+                print(f"[red]Error in config reload callback: {str(e)}[/red]")
+        return True
+
+    @staticmethod
+    def validate(config):
+        if not isinstance(config, dict):
+            raise ValueError("expected a JSON object")
+        if not isinstance(config.get('custom_text', ''), str):
+            raise ValueError("'custom_text' must be a string")
+        traits = config.get('traits', {})
+        if not isinstance(traits, dict):
+            raise ValueError("'traits' must be an object")
+        for trait, value in traits.items():
+            if not isinstance(value, (int, float)) or not 0 <= value <= 100:
+                raise ValueError(f"trait '{trait}' must be a number between 0 and 100")
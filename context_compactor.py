@@ -0,0 +1,66 @@
+import threading
+from rich import print
+
+class ContextCompactor:
+    """Keeps a ChatHistory near a fixed token budget by folding old turns into a rolling summary.
+
+    Once the history passes token_budget, the oldest turns are handed to summarize(previous_summary,
+    messages) on a background thread and replaced by the returned text. Folding continues
+    until the history is back at target_tokens, while the newest keep_recent messages are
+    always kept verbatim. The prompt sent each turn therefore stays roughly the same size
+    over a long session instead of growing to the model limit.
+    """
+
+    def __init__(self, chat_history, summarize, token_budget=3000, target_tokens=None, keep_recent=4):
+        self.chat_history = chat_history
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.target_tokens = target_tokens or token_budget * 2 // 3
+        self.keep_recent = keep_recent
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def maybe_compact(self):
+        """Starts a compaction if the history is over budget and none is running. Returns True if one started."""
+        if self.chat_history.total_tokens <= self.token_budget:
+            return False
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(target=self._compact, name="context-compactor", daemon=True)
+            self._thread.start()
+        return True
+
+    def wait(self, timeout=None):
+        thread = self._thread
+        if thread:
+            thread.join(timeout)
+
+    def _messages_to_fold(self):
+        messages = self.chat_history.conversation()
+        counts = self.chat_history.token_counts()
+        excess = self.chat_history.total_tokens - self.target_tokens
+        foldable = max(0, len(messages) - self.keep_recent)
+        count = folded_tokens = 0
+        while count < foldable and folded_tokens < excess:
+            folded_tokens += counts[count]
+            count += 1
+        # Never split a question from its answer
+        while 0 < count < foldable and messages[count].get('role') != 'user':
+            count += 1
+        return messages[:count]
+
+    def _compact(self):
+        messages = self._messages_to_fold()
+        if not messages:
+            return
+        previous_summary = self.chat_history.summary_message
+        try:
+            summary = self.summarize(previous_summary['content'] if previous_summary else None, messages)
+        except Exception as e:
+            # The hard token limit still applies, so the next turn simply tries again
+            print(f"[red]Error summarizing the conversation: {str(e)}[/red]")
+            return
+        if self.chat_history.fold(messages, summary):
+            print(f"[coral]Folded {len(messages)} message(s) into the conversation summary. "
+                  f"New token length is: {self.chat_history.total_tokens}")
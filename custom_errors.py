@@ -1,3 +1,7 @@
 class AIAssistantError(Exception):
     """Custom exception class for AI Assistant related errors."""
+    pass
+
+class TurnCancelled(AIAssistantError):
+    """Raised when a turn's CancelToken was cancelled, e.g. by the cancel hotkey or barge-in."""
     pass
\ No newline at end of file
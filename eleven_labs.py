@@ -1,66 +1,288 @@
-from elevenlabs import generate, stream, set_api_key, voices, play, save
 from requests.exceptions import HTTPError
+import io
 import time
 import os
-from custom_errors import AIAssistantError
+import hashlib
+import wave
+from custom_errors import AIAssistantError, TurnCancelled
+from http_sessions import ELEVENLABS_BASE_URL
+from tts_cache import TTSCache
+from voice_catalogue import VoiceCatalogue
+from tracing import tracer
+
+elevenlabs = None  # The elevenlabs SDK is only imported by initialize()
+
+def _import_elevenlabs():
+    global elevenlabs
+    if elevenlabs is None:
+        import elevenlabs as sdk
+        elevenlabs = sdk
+
+ELEVENLABS_MODEL = "eleven_monolingual_v1"
+MP3_OUTPUT_FORMAT = "mp3_44100_128"  # What the API returns when no output_format is asked for
+PCM_SAMPLE_RATES = (16000, 22050, 24000, 44100)  # Raw mono 16-bit little-endian output formats, e.g. "pcm_44100"
+
+def pcm_to_wav(pcm, sample_rate, channels=1):
+    """Wraps raw 16-bit PCM in a WAV header, so the saved file plays anywhere."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+    return buffer.getvalue()
 
 class ElevenLabsManager:
-    def __init__(self):
+    def __init__(self, use_cache=True, cache_dir="tts_cache", cache_max_entries=1000, cache_max_bytes=256 * 1024 * 1024, http_pool=None,
+                 output_format=MP3_OUTPUT_FORMAT):
         self.api_key = None
-        self.voices_list = None
+        self.voice_catalogue = None
+        self.http_pool = http_pool
+        self.output_format = output_format  # See negotiate_output_format()
+        self.tts_cache = TTSCache(cache_dir, cache_max_entries, cache_max_bytes) if use_cache else None
 
     def initialize(self):
         try:
             self.api_key = os.environ['ELEVENLABS_API_KEY']
-            set_api_key(self.api_key)
-            # Fetch and store the list of voices
-            self.voices_list = voices()
-            print(f"\nAll ElevenLabs voices: \n{self.voices_list}\n")
+            _import_elevenlabs()
+            elevenlabs.set_api_key(self.api_key)
+            # Serve the list of voices from disk; it is only re-downloaded in the background once stale
+            self.voice_catalogue = VoiceCatalogue(self._fetch_voices)
+            self.voice_catalogue.load()
         except KeyError:
             raise AIAssistantError("ELEVENLABS_API_KEY not found in environment variables.")
         except Exception as e:
             raise AIAssistantError(f"Error initializing ElevenLabs: {str(e)}")
 
     def cleanup(self):
-        pass
+        if self.tts_cache is not None:
+            self.tts_cache.save_index()
+
+    def _fetch_voices(self):
+        if not self.http_pool:
+            return [{"voice_id": v.voice_id, "name": v.name, "category": v.category} for v in elevenlabs.voices()]
+
+        response = self.http_pool.elevenlabs_session.get(
+            f"{ELEVENLABS_BASE_URL}/voices",
+            headers={"xi-api-key": self.api_key},
+            timeout=self.http_pool.timeout
+        )
+        response.raise_for_status()
+        self.http_pool.mark_used()
+        return response.json()["voices"]
+
+    def negotiate_output_format(self, sample_rates):
+        """Switches to raw PCM at a rate the player can take as is. Returns that rate, or None if MP3 is kept.
+
+        The highest rate in both PCM_SAMPLE_RATES and sample_rates wins. Without a common
+        rate, the highest one below the player's is used and the player only resamples,
+        which is still far cheaper than decoding MP3. The SDK path always returns MP3.
+        Not every subscription tier may ask for every PCM rate; if the account turns the
+        format down, the first request falls back to MP3 (see _generate_audio()).
+        """
+        if not self.http_pool or not sample_rates:
+            return None
+        common = set(PCM_SAMPLE_RATES) & set(sample_rates)
+        if common:
+            rate = max(common)
+        else:
+            rate = max((r for r in PCM_SAMPLE_RATES if r <= max(sample_rates)), default=PCM_SAMPLE_RATES[0])
+        self.output_format = f"pcm_{rate}"
+        return rate
+
+    @property
+    def pcm_sample_rate(self):
+        if self.output_format.startswith("pcm_"):
+            return int(self.output_format[len("pcm_"):])
+        return None
+
+    @property
+    def playback_format(self):
+        """Keyword arguments for AudioManager.enqueue_audio() describing what text_to_audio_bytes() returns."""
+        sample_rate = self.pcm_sample_rate
+        if sample_rate:
+            return {"audio_format": "pcm", "sample_rate": sample_rate, "channels": 1}
+        return {"audio_format": "mp3"}
+
+    def _voice_id(self, voice):
+        # Not a known name, so assume we were given a voice ID
+        return self.voice_catalogue.voice_id(voice) or voice
+
+    def _generate(self, input_text, voice, stream=False, cancel_token=None, output_format=None):
+        """Calls the text-to-speech endpoint over the shared keep-alive session, or through the SDK without one."""
+        output_format = output_format or self.output_format
+        # With stream=True this only covers the time until the response headers arrive
+        with tracer.span("tts.synthesize", chars=len(input_text), stream=stream, format=output_format):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            audio = self._request_audio(input_text, voice, stream, cancel_token, output_format)
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            return audio
+
+    def _generate_audio(self, input_text, voice, cancel_token=None):
+        """_generate() in output_format. Returns the audio and the output format it is in.
+
+        If ElevenLabs refuses a PCM format with a client error, e.g. because the account's
+        tier doesn't include it, output_format is switched back to MP3 for good and the
+        request is repeated. Should the MP3 request fail the same way, the error wasn't
+        about the format, so PCM is restored and the error raised.
+        """
+        output_format = self.output_format
+        try:
+            return self._generate(input_text, voice, cancel_token=cancel_token, output_format=output_format), output_format
+        except HTTPError as e:
+            if not output_format.startswith("pcm_") or e.response is None or e.response.status_code not in (400, 403, 422):
+                raise
+            print(f"ElevenLabs refused the {output_format} output format ({e.response.status_code}), falling back to MP3.")
+
+        self.output_format = MP3_OUTPUT_FORMAT
+        try:
+            return self._generate(input_text, voice, cancel_token=cancel_token, output_format=MP3_OUTPUT_FORMAT), MP3_OUTPUT_FORMAT
+        except HTTPError as e:
+            if e.response is not None and e.response.status_code in (400, 403, 422):
+                self.output_format = output_format
+            raise
+
+    def _request_audio(self, input_text, voice, stream, cancel_token=None, output_format=MP3_OUTPUT_FORMAT):
+        if not self.http_pool:
+            # Passing a Voice object stops the SDK from looking the voice up again on every call
+            sdk_voice = elevenlabs.Voice(voice_id=self._voice_id(voice), name=voice)
+            return elevenlabs.generate(text=input_text, voice=sdk_voice, model=ELEVENLABS_MODEL, stream=stream)
+
+        # A cancellable request streams the body, so closing the response stops the synthesis midway
+        streamed = stream or cancel_token is not None
+        url = f"{ELEVENLABS_BASE_URL}/text-to-speech/{self._voice_id(voice)}"
+        if streamed:
+            url += "/stream"
+        response = self.http_pool.elevenlabs_session.post(
+            url,
+            params={"output_format": output_format},
+            json={"text": input_text, "model_id": ELEVENLABS_MODEL},
+            headers={"xi-api-key": self.api_key, "accept": "audio/mpeg" if output_format.startswith("mp3") else "*/*"},
+            stream=streamed,
+            timeout=self.http_pool.timeout
+        )
+        response.raise_for_status()
+        self.http_pool.mark_used()
+        if stream:
+            return response.iter_content(chunk_size=4096)
+        if cancel_token is None:
+            return response.content
+
+        cancel_token.add_callback(response.close)
+        try:
+            chunks = []
+            for chunk in response.iter_content(chunk_size=4096):
+                if cancel_token.cancelled:
+                    break
+                chunks.append(chunk)
+            return b"".join(chunks)
+        except Exception:
+            # Reading a response that cancel() closed fails; the caller checks the token
+            if cancel_token.cancelled:
+                return b""
+            raise
+        finally:
+            cancel_token.remove_callback(response.close)
+            response.close()
+
+    def _cache_key(self, input_text, voice, audio_format):
+        if self.tts_cache is None:
+            return None
+        return TTSCache.make_key(input_text, voice, ELEVENLABS_MODEL, audio_format)
+
+    @staticmethod
+    def _file_format(output_format, save_as_wave):
+        """The file extension text_to_audio() saves output_format as, and the audio format its cache key uses."""
+        if output_format.startswith("pcm_"):
+            return "wav", f"{output_format}.wav"
+        extension = "wav" if save_as_wave else "mp3"
+        return extension, extension
 
     def text_to_audio(self, input_text, voice="Rachel", save_as_wave=True, subdirectory=""):
+        """Saves the speech for input_text and returns the file path. Raw PCM output is always saved as a WAV file."""
+        output_format = self.output_format
+        file_extension, cache_format = self._file_format(output_format, save_as_wave)
+        cache_key = self._cache_key(input_text, voice, cache_format)
+        if cache_key:
+            cached_path = self.tts_cache.get_path(cache_key)
+            if cached_path:
+                print("Using cached ElevenLabs audio.")
+                return cached_path
+
         if not self.api_key:
             self.initialize()
 
         try:
-            audio_saved = generate(
-                text=input_text,
-                voice=voice,
-                model="eleven_monolingual_v1"
-            )
+            audio_saved, audio_format = self._generate_audio(input_text, voice)
         except HTTPError as e:
             print(f"An error occurred: {e.response.json()}")
             raise AIAssistantError(f"ElevenLabs API error: {str(e)}")
         except Exception as e:
             raise AIAssistantError(f"Error in text-to-audio conversion: {str(e)}")
 
-        file_extension = "wav" if save_as_wave else "mp3"
-        file_name = f"___Msg{str(hash(input_text))}.{file_extension}"
-        tts_file = os.path.join(os.path.abspath(os.curdir), subdirectory, file_name)
-        
+        if audio_format != output_format:
+            # ElevenLabs turned the PCM format down and MP3 was returned instead
+            file_extension, cache_format = self._file_format(audio_format, save_as_wave)
+            cache_key = self._cache_key(input_text, voice, cache_format)
+        if audio_format.startswith("pcm_"):
+            audio_saved = pcm_to_wav(audio_saved, int(audio_format[len("pcm_"):]))
+
         try:
-            save(audio_saved, tts_file)
-            return tts_file
+            with tracer.span("tts.save", bytes=len(audio_saved)):
+                if cache_key:
+                    # Cached files are owned by the cache; callers must not delete them
+                    return self.tts_cache.put(cache_key, audio_saved, file_extension)
+
+                file_name = f"___Msg{hashlib.sha256(input_text.encode('utf-8')).hexdigest()[:16]}.{file_extension}"
+                tts_file = os.path.join(os.path.abspath(os.curdir), subdirectory, file_name)
+                elevenlabs.save(audio_saved, tts_file)
+                return tts_file
         except Exception as e:
             raise AIAssistantError(f"Error saving audio file: {str(e)}")
 
+    def text_to_audio_bytes(self, input_text, voice="Rachel", cancel_token=None):
+        """Returns the audio for input_text in playback_format. Raises TurnCancelled, without caching anything, if cancel_token is cancelled meanwhile."""
+        output_format = self.output_format
+        cache_key = self._cache_key(input_text, voice, output_format if output_format.startswith("pcm_") else "mp3")
+        if cache_key:
+            cached_audio = self.tts_cache.get_bytes(cache_key)
+            if cached_audio is not None:
+                return cached_audio
+
+        if not self.api_key:
+            self.initialize()
+
+        try:
+            audio, audio_format = self._generate_audio(input_text, voice, cancel_token)
+        except TurnCancelled:
+            raise
+        except HTTPError as e:
+            print(f"An error occurred: {e.response.json()}")
+            raise AIAssistantError(f"ElevenLabs API error: {str(e)}")
+        except Exception as e:
+            raise AIAssistantError(f"Error in text-to-audio conversion: {str(e)}")
+
+        if cache_key:
+            if audio_format != output_format:
+                # ElevenLabs turned the PCM format down; playback_format now describes MP3 as well
+                cache_key = self._cache_key(input_text, voice, "mp3")
+            try:
+                with tracer.span("tts.save", bytes=len(audio)):
+                    self.tts_cache.put(cache_key, audio, "pcm" if audio_format.startswith("pcm_") else "mp3")
+            except OSError as e:
+                print(f"Couldn't cache ElevenLabs audio: {str(e)}")
+        return audio
+
     def text_to_audio_played(self, input_text, voice="Rachel"):
         if not self.api_key:
             self.initialize()
 
         try:
-            audio = generate(
-                text=input_text,
-                voice=voice,
-                model="eleven_monolingual_v1"
-            )
-            play(audio)
+            # elevenlabs.play() hands the audio to ffplay, which needs a container format
+            audio = self._generate(input_text, voice, output_format=MP3_OUTPUT_FORMAT)
+            elevenlabs.play(audio)
         except HTTPError as e:
             print(f"An error occurred: {e.response.json()}")
             raise AIAssistantError(f"ElevenLabs API error: {str(e)}")
@@ -68,24 +290,37 @@ class ElevenLabsManager:
             raise AIAssistantError(f"Error in text-to-audio playback: {str(e)}")
 
     def text_to_audio_streamed(self, input_text, voice="Rachel"):
+        cache_key = self._cache_key(input_text, voice, "mp3")
+        if cache_key:
+            cached_audio = self.tts_cache.get_bytes(cache_key)
+            if cached_audio is not None:
+                try:
+                    _import_elevenlabs()
+                    elevenlabs.play(cached_audio)
+                    return
+                except Exception as e:
+                    raise AIAssistantError(f"Error in text-to-audio playback: {str(e)}")
+
         if not self.api_key:
             self.initialize()
 
         try:
-            audio_stream = generate(
-                text=input_text,
-                voice=voice,
-                model="eleven_monolingual_v1",
-                stream=True
-            )
-            stream(audio_stream)
+            audio_stream = self._generate(input_text, voice, stream=True, output_format=MP3_OUTPUT_FORMAT)
+            # stream() plays the chunks as they arrive and hands back the whole clip
+            audio = elevenlabs.stream(audio_stream)
         except HTTPError as e:
             print(f"An error occurred: {e.response.json()}")
             raise AIAssistantError(f"ElevenLabs API error: {str(e)}")
         except Exception as e:
             raise AIAssistantError(f"Error in text-to-audio streaming: {str(e)}")
 
+        if cache_key and audio:
+            try:
+                self.tts_cache.put(cache_key, audio, "mp3")
+            except OSError as e:
+                print(f"Couldn't cache ElevenLabs audio: {str(e)}")
+
     def get_available_voices(self):
-        if not self.voices_list:
+        if not self.voice_catalogue:
             self.initialize()
-        return self.voices_list
\ No newline at end of file
+        return self.voice_catalogue.voices
\ No newline at end of file
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+from rich import print
+
+FILLER_PHRASES = {
+    'neutral': ["Hmm, let me think.", "Good question.", "Okay, one second.", "Let me see..."],
+    'humor': ["Ooh, good question...", "Oh, this is a fun one.", "Hold that thought..."],
+    'professionalism': ["One moment, please.", "Let me look into that.", "Certainly, just a second."],
+    'sarcasm': ["Oh, sure, let me think about that...", "Wow. Okay. Give me a second."],
+    'dramatic_flair': ["Ahh, now that is a question...", "Oh-ho, where do I even begin..."],
+    'outbursts': ["Oh! Okay, okay...", "Whoa, alright, hang on..."],
+    'empathy': ["Mm, I hear you.", "Okay, let's think about that together."],
+}
+
+def phrases_for_config(config, threshold=70):
+    """Filler phrases that fit the personality in config.
+
+    An explicit 'filler_phrases' list wins. Otherwise the neutral phrases are mixed with
+    those of the (at most two) strongest traits at or above threshold.
+    """
+    config = config or {}
+    if config.get('filler_phrases'):
+        return [str(phrase) for phrase in config['filler_phrases']]
+    traits = config.get('traits', {})
+    strongest = sorted((value, trait) for trait, value in traits.items() if trait in FILLER_PHRASES and value >= threshold)
+    phrases = list(FILLER_PHRASES['neutral'])
+    for _, trait in reversed(strongest[-2:]):
+        phrases += FILLER_PHRASES[trait]
+    return phrases
+
+class FillerLibrary:
+    """Short pre-rendered acknowledgements ("Ooh, good question...") played while the answer is on its way.
+
+    Clips are synthesized once per voice, phrase list and output format through
+    resource_manager.eleven_labs and kept on disk under directory, so later runs load
+    them straight away. rebuild() does its work on a background thread; until it has
+    finished, the previous clips (or none) are handed out.
+    """
+
+    def __init__(self, resource_manager, directory="filler_clips"):
+        self.resource_manager = resource_manager
+        self.directory = directory
+        self.playback_format = None
+        self._clips = []  # (phrase, audio bytes)
+        self._key = None
+        self._last_index = None
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._thread = None
+
+    @property
+    def ready(self):
+        return bool(self._clips)
+
+    def rebuild(self, voice, phrases):
+        """Switches to clips for voice and phrases, synthesizing the ones that aren't on disk in the background."""
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        self._thread = threading.Thread(target=self._build, args=(generation, voice, list(phrases)), name="filler-library", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        thread = self._thread
+        if thread:
+            thread.join(timeout)
+
+    def pick(self):
+        """Returns (audio bytes, playback format) for a random clip, never the same one twice in a row, or None."""
+        with self._lock:
+            if not self._clips:
+                return None
+            choices = [i for i in range(len(self._clips)) if i != self._last_index] or [0]
+            self._last_index = random.choice(choices)
+            return self._clips[self._last_index][1], self.playback_format
+
+    def _build(self, generation, voice, phrases):
+        try:
+            eleven_labs = self.resource_manager.eleven_labs
+            while True:
+                output_format = eleven_labs.output_format
+                playback_format = eleven_labs.playback_format
+                key = hashlib.sha256(json.dumps([voice, phrases, output_format], ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+                if key == self._key:
+                    return
+                folder = os.path.join(self.directory, key)
+                clips = self._load(folder, phrases)
+                if clips is None:
+                    print(f"[coral]Rendering {len(phrases)} filler clip(s) for {voice}...")
+                    clips = []
+                    for phrase in phrases:
+                        if generation != self._generation:
+                            return  # A newer rebuild took over
+                        clips.append((phrase, eleven_labs.text_to_audio_bytes(phrase, voice)))
+                    if eleven_labs.output_format != output_format:
+                        continue  # ElevenLabs turned the PCM format down midway, so the clips are in mixed formats
+                    self._save(folder, clips, playback_format)
+                break
+        except Exception as e:
+            print(f"[red]Couldn't build the filler clip library: {str(e)}[/red]")
+            return
+
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._clips = clips
+            self.playback_format = playback_format
+            self._key = key
+            self._last_index = None
+        self._remove_stale(key)
+
+    @staticmethod
+    def _load(folder, phrases):
+        try:
+            with open(os.path.join(folder, "manifest.json"), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest['phrases'] != phrases:
+                return None
+            clips = []
+            for phrase, file_name in zip(manifest['phrases'], manifest['files']):
+                with open(os.path.join(folder, file_name), 'rb') as f:
+                    clips.append((phrase, f.read()))
+            return clips
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def _save(folder, clips, playback_format):
+        os.makedirs(folder, exist_ok=True)
+        extension = playback_format['audio_format']
+        files = []
+        for index, (_, audio) in enumerate(clips):
+            files.append(f"{index:02d}.{extension}")
+            with open(os.path.join(folder, files[-1]), 'wb') as f:
+                f.write(audio)
+        # The manifest is written last, so a half-written folder is never loaded
+        temp_path = os.path.join(folder, "manifest.json.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"phrases": [phrase for phrase, _ in clips], "files": files}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, os.path.join(folder, "manifest.json"))
+
+    def _remove_stale(self, key):
+        """Deletes clips rendered for earlier voices or personalities."""
+        try:
+            for name in os.listdir(self.directory):
+                if name != key:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        except OSError:
+            pass
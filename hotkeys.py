@@ -0,0 +1,75 @@
+import queue
+import threading
+import time
+from rich import print
+from tracing import tracer
+
+DEFAULT_BINDINGS = {
+    'start': 'f4',    # Start a new interaction
+    'stop': 'p',      # Finish the question being recorded
+    'cancel': 'esc',  # Drop the current answer and stop talking
+    'replay': 'f5',   # Say the last answer again
+}
+
+class HotkeyDispatcher:
+    """Turns global hotkeys into actions delivered to handlers on one dispatcher thread.
+
+    The keyboard hook only puts (action, time) on a queue, so presses are never lost
+    while a handler or another part of the pipeline is busy, and nothing polls the
+    keyboard. Handlers for an action run in the order they were added.
+    """
+
+    def __init__(self, bindings=None):
+        self.bindings = dict(DEFAULT_BINDINGS)
+        self.bindings.update(bindings or {})
+        self.events = queue.Queue()
+        self._handlers = {action: [] for action in self.bindings}
+        self._hotkeys = []
+        self._thread = None
+
+    def on(self, action, handler):
+        """Calls handler() every time the action's hotkey is pressed."""
+        if action not in self._handlers:
+            raise ValueError(f"Unknown hotkey action: {action}")
+        self._handlers[action].append(handler)
+
+    def off(self, action, handler):
+        try:
+            self._handlers[action].remove(handler)
+        except (KeyError, ValueError):
+            pass
+
+    def start(self):
+        import keyboard
+        for action, hotkey in self.bindings.items():
+            if hotkey:
+                self._hotkeys.append(keyboard.add_hotkey(hotkey, self.trigger, args=(action,)))
+        self._thread = threading.Thread(target=self._dispatch_loop, name="hotkeys", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        import keyboard
+        for hotkey in self._hotkeys:
+            keyboard.remove_hotkey(hotkey)
+        self._hotkeys = []
+        if self._thread:
+            self.events.put(None)
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def trigger(self, action):
+        """Queues an action as if its hotkey was pressed, e.g. from a GUI button."""
+        self.events.put((action, time.monotonic()))
+
+    def _dispatch_loop(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            action, pressed_at = event
+            tracer.record("hotkey.dispatch", time.monotonic() - pressed_at, action=action)
+            for handler in list(self._handlers.get(action, [])):
+                try:
+                    handler()
+                except Exception as e:
+                    print(f"[red]Error handling the {action} hotkey: {str(e)}[/red]")
@@ -0,0 +1,87 @@
+import threading
+import time
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+ELEVENLABS_BASE_URL = "https://api.elevenlabs.io/v1"
+
+class HttpSessionPool:
+    """Shared keep-alive HTTP connection pools for the OpenAI and ElevenLabs clients.
+
+    OpenAI's client is built on httpx and ElevenLabs is called through requests, so
+    one pooled client of each kind is kept for the lifetime of the assistant.
+    """
+
+    def __init__(self, max_connections=8, max_keepalive_connections=4, keepalive_expiry=60.0, timeout=60.0):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.openai_client = None
+        self.elevenlabs_session = None
+        self._last_used = time.monotonic()
+        self._warmer_thread = None
+        self._stop_warmer = threading.Event()
+
+    def initialize(self):
+        self.openai_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=self.timeout
+        )
+
+        self.elevenlabs_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_keepalive_connections, pool_maxsize=self.max_connections)
+        self.elevenlabs_session.mount("https://", adapter)
+        self.elevenlabs_session.mount("http://", adapter)
+
+    def cleanup(self):
+        self._stop_warmer.set()
+        if self._warmer_thread:
+            self._warmer_thread.join(timeout=1)
+            self._warmer_thread = None
+        if self.openai_client:
+            self.openai_client.close()
+        if self.elevenlabs_session:
+            self.elevenlabs_session.close()
+
+    def mark_used(self):
+        self._last_used = time.monotonic()
+
+    def warm_up(self, openai_url=OPENAI_BASE_URL, elevenlabs_url=ELEVENLABS_BASE_URL):
+        """Opens (or refreshes) one pooled connection to each API so the next real request skips TCP+TLS setup."""
+        # Any response, even a 401/404, leaves a warm connection in the pool
+        try:
+            self.openai_client.head(openai_url, timeout=5)
+        except httpx.HTTPError as e:
+            print(f"OpenAI warm-up failed: {str(e)}")
+        try:
+            self.elevenlabs_session.head(elevenlabs_url, timeout=5)
+        except requests.RequestException as e:
+            print(f"ElevenLabs warm-up failed: {str(e)}")
+
+    def start_idle_warmer(self, idle_seconds=None, check_interval=5.0):
+        """Re-warms the pools whenever nothing has used them for idle_seconds.
+
+        The default keeps connections from hitting keepalive_expiry between turns.
+        """
+        if self._warmer_thread:
+            return
+        idle_seconds = idle_seconds or self.keepalive_expiry * 0.75
+
+        def warm_when_idle():
+            # Open the first connections right away so the first turn doesn't pay for them
+            self.warm_up()
+            self.mark_used()
+            while not self._stop_warmer.wait(check_interval):
+                if time.monotonic() - self._last_used >= idle_seconds:
+                    self.warm_up()
+                    self.mark_used()
+
+        self._warmer_thread = threading.Thread(target=warm_when_idle, name="http-warmer", daemon=True)
+        self._warmer_thread.start()
@@ -0,0 +1,44 @@
+import queue
+from custom_errors import AIAssistantError
+
+class MicrophoneCapture:
+    """Captures 16-bit mono PCM from the default microphone through SDL.
+
+    Frames are handed over on a queue so the SDL callback never waits on the
+    recognizer or the voice activity detector.
+    """
+
+    def __init__(self, sample_rate=16000, chunk_size=320):
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.frames = queue.Queue()
+        self.device = None
+
+    def open(self):
+        import pygame._sdl2 as sdl2
+        from pygame._sdl2.audio import AudioDevice, AUDIO_S16, get_audio_device_names
+
+        try:
+            sdl2.init_subsystem(sdl2.INIT_AUDIO)
+            self.device = AudioDevice(
+                devicename=get_audio_device_names(True)[0],
+                iscapture=True,
+                frequency=self.sample_rate,
+                audioformat=AUDIO_S16,
+                numchannels=1,
+                chunksize=self.chunk_size,
+                allowed_changes=0,
+                callback=self._audio_callback
+            )
+        except Exception as e:
+            raise AIAssistantError(f"Failed to open microphone: {str(e)}")
+        self.device.pause(0)
+
+    def close(self):
+        if self.device:
+            self.device.close()
+            self.device = None
+        self.frames.put(None)
+
+    def _audio_callback(self, device, stream):
+        self.frames.put(bytes(stream))
@@ -1,39 +1,359 @@
-from openai import OpenAI
-import tiktoken
+from collections import OrderedDict, deque
 import os
+import threading
+import time
 from rich import print
 from custom_errors import AIAssistantError
+from context_compactor import ContextCompactor
+from tracing import tracer
+
+MEMO_MAX_ENTRIES = 4096  # Per-message token counts remembered across calls
+BATCH_THREADS = 8  # Threads tiktoken uses to encode a batch
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+_token_memo = OrderedDict()  # (encoding name, message fields) -> token count, least recently used first
+_token_memo_lock = threading.Lock()
+
+def get_encoding(model):
+    """Returns the tiktoken encoding for model, loading it only once per process."""
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    with _encodings_lock:
+        encoding = _encodings.get(model)
+        if encoding is None:
+            # tiktoken is only imported once token counting is actually needed
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                raise NotImplementedError(f"""Token counting is not presently implemented for model {model}.
+        See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens.""")
+            _encodings[model] = encoding
+        return encoding
+
+def warm_up_encodings(models=('gpt-4',)):
+    """Loads the encodings ahead of time, e.g. during startup, so the first turn doesn't pay for it."""
+    for model in models:
+        get_encoding(model)
+
+def _memo_key(message, encoding):
+    return (encoding.name, tuple(message.items()))
+
+def _memo_get(key):
+    with _token_memo_lock:
+        count = _token_memo.get(key)
+        if count is not None:
+            _token_memo.move_to_end(key)
+        return count
+
+def _memo_put(key, count):
+    with _token_memo_lock:
+        _token_memo[key] = count
+        _token_memo.move_to_end(key)
+        while len(_token_memo) > MEMO_MAX_ENTRIES:
+            _token_memo.popitem(last=False)
+
+def _count_from_lengths(message, lengths):
+    num_tokens = 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
+    for key, length in zip(message, lengths):
+        num_tokens += length
+        if key == "name":  # if there's a name, the role is omitted
+            num_tokens += -1  # role is always required and always 1 token
+    return num_tokens
+
+def num_tokens_from_message(message, encoding):
+    """Returns the number of tokens used by a single message, excluding the reply priming."""
+    key = _memo_key(message, encoding)
+    count = _memo_get(key)
+    if count is None:
+        count = _count_from_lengths(message, [len(encoding.encode_ordinary(value)) for value in message.values()])
+        _memo_put(key, count)
+    return count
+
+def count_tokens_batch(messages, model='gpt-4', num_threads=BATCH_THREADS):
+    """Returns the token count of each message, excluding the reply priming.
+
+    Counts come from the memo where possible. All fields of the remaining messages
+    are encoded in one tiktoken batch call, which runs on num_threads native threads.
+    """
+    encoding = get_encoding(model)
+    keys = [_memo_key(message, encoding) for message in messages]
+    with _token_memo_lock:
+        counts = [_token_memo.get(key) for key in keys]
+    missing = [index for index, count in enumerate(counts) if count is None]
+    if missing:
+        texts = [value for index in missing for value in messages[index].values()]
+        lengths = iter(map(len, encoding.encode_ordinary_batch(texts, num_threads=num_threads)))
+        for index in missing:
+            counts[index] = _count_from_lengths(messages[index], [next(lengths) for _ in messages[index]])
+    with _token_memo_lock:
+        for index, key in enumerate(keys):
+            # Refreshes recency for hits and stores the new counts
+            _token_memo[key] = counts[index]
+            _token_memo.move_to_end(key)
+        while len(_token_memo) > MEMO_MAX_ENTRIES:
+            _token_memo.popitem(last=False)
+    return counts
 
 def num_tokens_from_messages(messages, model='gpt-4'):
     """Returns the number of tokens used by a list of messages."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-        num_tokens = 0
-        for message in messages:
-            num_tokens += 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":  # if there's a name, the role is omitted
-                    num_tokens += -1  # role is always required and always 1 token
-        num_tokens += 2  # every reply is primed with <im_start>assistant
-        return num_tokens
-    except Exception:
-        raise NotImplementedError(f"""num_tokens_from_messages() is not presently implemented for model {model}.
-        See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens.""")
+    return sum(count_tokens_batch(list(messages), model)) + 2  # every reply is primed with <im_start>assistant
+
+class ChatHistory:
+    """Chat messages with token counts computed once on append and kept as a running total.
+
+    Besides the system message there is an optional summary message that stands in
+    for older turns folded away by a ContextCompactor. It is sent right after the
+    system message and is never trimmed. All mutations take a lock, since compaction
+    runs on a background thread.
+    """
+
+    REPLY_PRIMING_TOKENS = 2  # every reply is primed with <im_start>assistant
+    SUMMARY_NAME = "conversation_summary"  # name field that marks the summary message
+
+    def __init__(self, model='gpt-4', messages=None):
+        self.model = model
+        self._encoding = None
+        self._lock = threading.RLock()
+        self.system_message = None
+        self._system_tokens = 0
+        self.summary_message = None
+        self._summary_tokens = 0
+        self._messages = deque()
+        self._token_counts = deque()
+        self._total_tokens = 0
+        if messages:
+            self.extend(messages)
+
+    def _count(self, message):
+        if self._encoding is None:
+            self._encoding = get_encoding(self.model)
+        return num_tokens_from_message(message, self._encoding)
+
+    @property
+    def total_tokens(self):
+        return self._system_tokens + self._summary_tokens + self._total_tokens + self.REPLY_PRIMING_TOKENS
+
+    def set_system_message(self, message):
+        self.system_message = message
+        self._system_tokens = self._count(message) if message else 0
+
+    def set_summary(self, summary):
+        """Sets the rolling summary from its text or a full message; None removes it."""
+        if isinstance(summary, str):
+            summary = {"role": "system", "name": self.SUMMARY_NAME, "content": summary}
+        with self._lock:
+            self.summary_message = summary
+            self._summary_tokens = self._count(summary) if summary else 0
+
+    def append(self, message):
+        if message.get('role') == 'system' and message.get('name') == self.SUMMARY_NAME:
+            self.set_summary(message)
+            return
+        if message.get('role') == 'system' and self.system_message is None and not self._messages:
+            self.set_system_message(message)
+            return
+        count = self._count(message)
+        with self._lock:
+            self._messages.append(message)
+            self._token_counts.append(count)
+            self._total_tokens += count
+
+    def extend(self, messages):
+        """Appends many messages, counting all of their tokens in one batch."""
+        messages = list(messages)
+        while messages and (messages[0].get('role') == 'system'):
+            # Leading system and summary messages go to their own slots
+            self.append(messages.pop(0))
+        counts = count_tokens_batch(messages, self.model)
+        with self._lock:
+            self._messages.extend(messages)
+            self._token_counts.extend(counts)
+            self._total_tokens += sum(counts)
+
+    def pop_oldest(self):
+        """Removes the oldest non-system message in O(1) and returns it."""
+        with self._lock:
+            self._total_tokens -= self._token_counts.popleft()
+            return self._messages.popleft()
+
+    def trim(self, max_tokens):
+        """Drops the oldest non-system messages until the history fits in max_tokens."""
+        popped = 0
+        with self._lock:
+            while self._messages and self.total_tokens > max_tokens:
+                self.pop_oldest()
+                popped += 1
+        return popped
+
+    def fold(self, messages, summary):
+        """Replaces the given oldest messages with a new summary.
+
+        Returns False and changes nothing if those messages are no longer the oldest
+        ones, e.g. because they were trimmed while the summary was being written.
+        """
+        with self._lock:
+            if len(messages) > len(self._messages) or any(a is not b for a, b in zip(messages, self._messages)):
+                return False
+            for _ in messages:
+                self.pop_oldest()
+            self.set_summary(summary)
+            return True
+
+    def replace(self, old_message, new_message):
+        """Swaps a message, found by identity, for another one. Returns False if it is no longer in the history."""
+        with self._lock:
+            for index in range(len(self._messages) - 1, -1, -1):
+                if self._messages[index] is old_message:
+                    count = self._count(new_message)
+                    self._total_tokens += count - self._token_counts[index]
+                    self._messages[index] = new_message
+                    self._token_counts[index] = count
+                    return True
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._messages.clear()
+            self._token_counts.clear()
+            self._total_tokens = 0
+            self.set_summary(None)
+
+    def conversation(self):
+        """Returns the non-system messages, oldest first."""
+        with self._lock:
+            return list(self._messages)
+
+    def token_counts(self):
+        """Returns the token count of each non-system message, oldest first."""
+        with self._lock:
+            return list(self._token_counts)
+
+    def persistent_messages(self):
+        """Returns the summary, if any, followed by the non-system messages; what a journal needs to keep."""
+        with self._lock:
+            messages = list(self._messages)
+            if self.summary_message:
+                messages.insert(0, self.summary_message)
+            return messages
+
+    def to_list(self):
+        with self._lock:
+            messages = self.persistent_messages()
+            if self.system_message:
+                messages.insert(0, self.system_message)
+            return messages
+
+    def __len__(self):
+        return len(self._messages) + (1 if self.system_message else 0) + (1 if self.summary_message else 0)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
 
 class OpenAiManager:
-    def __init__(self):
-        self.chat_history = []  # Stores the entire conversation
+    def __init__(self, http_pool=None, response_cache=None, context_budget=3000, summary_model="gpt-4"):
+        self.chat_history = ChatHistory()  # Stores the entire conversation
         self.client = None
+        self.http_pool = http_pool
+        self.response_cache = response_cache  # Optional ResponseCache; a hit skips the API call entirely
+        self.summary_model = summary_model
+        self.last_answer_message = None  # The assistant message most recently added by a chat_with_history call
+        # Older turns are folded into a summary between turns once the prompt passes context_budget tokens.
+        # None disables this and only the hard 8000 token trim applies.
+        self.compactor = ContextCompactor(self.chat_history, self.summarize, context_budget) if context_budget else None
 
     def initialize(self):
+        from openai import OpenAI
+        warm_up_encodings((self.chat_history.model,))
         try:
-            self.client = OpenAI(api_key=os.environ['OPENAI_API_KEY'])
+            if self.http_pool:
+                # Reuse the shared keep-alive pool instead of letting the client open its own
+                self.client = OpenAI(api_key=os.environ['OPENAI_API_KEY'], http_client=self.http_pool.openai_client)
+            else:
+                self.client = OpenAI(api_key=os.environ['OPENAI_API_KEY'])
         except KeyError:
             raise Exception("OPENAI_API_KEY not found in environment variables.")
 
     def cleanup(self):
-        pass
+        if self.compactor:
+            self.compactor.wait(timeout=10)
+
+    def _mark_http_used(self):
+        if self.http_pool:
+            self.http_pool.mark_used()
+
+    def _cached_answer(self, prompt, system_message):
+        if not self.response_cache:
+            return None
+        cached_answer = self.response_cache.get(prompt, system_message)
+        if cached_answer is not None:
+            print(f"[coral]Answered from the response cache ({self.response_cache.metrics['hit_rate']:.0%} hit rate).")
+        return cached_answer
+
+    def _is_first_exchange(self):
+        """True if the question just appended is the whole conversation, so its answer doesn't depend on earlier turns."""
+        return len(self.chat_history.conversation()) == 1 and not self.chat_history.summary_message
+
+    def _cache_answer(self, prompt, system_message, answer):
+        if self.response_cache:
+            self.response_cache.put(prompt, system_message, answer)
+
+    def compact_context(self):
+        """Starts folding old turns into the summary in the background if the history is over budget."""
+        if self.compactor:
+            return self.compactor.maybe_compact()
+        return False
+
+    def summarize(self, previous_summary, messages, max_words=200):
+        """Asks ChatGPT to merge messages into the previous summary text and returns the new summary."""
+        if not self.client:
+            self.initialize()
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        with tracer.span("llm.summarize", messages=len(messages)):
+            completion = self.client.chat.completions.create(
+                model=self.summary_model,
+                messages=[
+                    {"role": "system", "content": "You keep a running summary of a conversation between a user and an AI assistant. "
+                                                  "Merge the new messages into the existing summary. Keep names, facts, preferences, "
+                                                  "open questions and anything the assistant promised; drop small talk. "
+                                                  f"Reply with the updated summary only, in at most {max_words} words."},
+                    {"role": "user", "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"}
+                ]
+            )
+        self._mark_http_used()
+        return completion.choices[0].message.content.strip()
+
+    def _accept_speculation(self, speculation):
+        """Returns speculation if it can answer the question just appended to the history, otherwise None."""
+        if speculation is None:
+            return None
+        return speculation if speculation.accept(self.chat_history.to_list()[:-1]) else None
+
+    def _append_answer(self, answer):
+        self.last_answer_message = {"role": "assistant", "content": answer}
+        self.chat_history.append(self.last_answer_message)
+
+    def record_interrupted_answer(self, spoken_text, answer_message=None):
+        """Records only the part of an answer that was actually heard before the turn was cancelled.
+
+        answer_message is the full answer if it was already added to the history; it is
+        replaced. Otherwise a new assistant message is appended. Returns the recorded text.
+        """
+        spoken_text = spoken_text.strip()
+        content = f"{spoken_text} (interrupted)" if spoken_text else "(interrupted before answering)"
+        message = {"role": "assistant", "content": content}
+        if answer_message is None or not self.chat_history.replace(answer_message, message):
+            self.chat_history.append(message)
+        self.last_answer_message = message
+        return content
 
     def chat(self, prompt=""):
         if not self.client:
@@ -43,27 +363,42 @@ class OpenAiManager:
             print("Didn't receive input!")
             return
 
+        cached_answer = self._cached_answer(prompt, None)
+        if cached_answer is not None:
+            print(f"[green]\n{cached_answer}\n")
+            return cached_answer
+
         # Check that the prompt is under the token context limit
         chat_question = [{"role": "user", "content": prompt}]
-        if num_tokens_from_messages(chat_question) > 8000:
+        with tracer.span("llm.count_tokens"):
+            question_tokens = num_tokens_from_messages(chat_question)
+        if question_tokens > 8000:
             print("The length of this chat question is too large for the GPT model")
             return
 
         print("[yellow]\nAsking ChatGPT a question...")
         try:
-            completion = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=chat_question
-            )
+            with tracer.span("llm.request"):
+                completion = self.client.chat.completions.create(
+                    model="gpt-4",
+                    messages=chat_question
+                )
+            self._mark_http_used()
 
             # Process the answer
             openai_answer = completion.choices[0].message.content
+            self._cache_answer(prompt, None, openai_answer)
             print(f"[green]\n{openai_answer}\n")
             return openai_answer
         except Exception as e:
             raise Exception(f"Error in OpenAI API call: {str(e)}")
 
-    def chat_with_history(self, prompt=""):
+    def chat_with_history(self, prompt="", cancel_token=None, speculation=None):
+        """Asks with the whole chat history. The blocking request can't be aborted, but a cancelled turn skips it.
+
+        A Speculation from the SpeculativePrefetcher is waited for instead of a new request
+        if it was asked with the same history.
+        """
         if not self.client:
             self.initialize()
 
@@ -71,28 +406,197 @@ class OpenAiManager:
             print("Didn't receive input!")
             return
 
-        # Add our prompt into the chat history
-        self.chat_history.append({"role": "user", "content": prompt})
+        # Add our prompt into the chat history; its tokens are counted here, once
+        with tracer.span("llm.count_tokens"):
+            self.chat_history.append({"role": "user", "content": prompt})
+
+        # Only a question asked without earlier turns can be answered from, or stored in, the response cache
+        context_free = self._is_first_exchange()
+        speculation = self._accept_speculation(speculation)
 
         # Check total token limit. Remove old messages as needed
-        print(f"[coral]Chat History has a current token length of {num_tokens_from_messages(self.chat_history)}")
-        while num_tokens_from_messages(self.chat_history) > 8000:
-            self.chat_history.pop(1)  # We skip the 1st message since it's the system message
-            print(f"Popped a message! New token length is: {num_tokens_from_messages(self.chat_history)}")
+        print(f"[coral]Chat History has a current token length of {self.chat_history.total_tokens}")
+        popped = self.chat_history.trim(8000)  # Hard limit; the system and summary messages are never popped
+        if popped:
+            print(f"Popped {popped} message(s)! New token length is: {self.chat_history.total_tokens}")
+
+        cached_answer = self._cached_answer(prompt, self.chat_history.system_message) if context_free else None
+        if cached_answer is not None:
+            if speculation:
+                speculation.cancel()
+            self._append_answer(cached_answer)
+            print(f"[green]\n{cached_answer}\n")
+            self.compact_context()
+            return cached_answer
+
+        if cancel_token is not None and cancel_token.cancelled:
+            if speculation:
+                speculation.cancel()
+            # The question stays in the history, answered with a note that it was interrupted
+            return self.record_interrupted_answer("")
+
+        if speculation:
+            print("[yellow]\nWaiting for the speculative answer...")
+            with tracer.span("llm.request", prompt_tokens=self.chat_history.total_tokens, speculative=True):
+                openai_answer = "".join(speculation.deltas())
+            # A cancelled speculation stops midway; the truncated answer is neither kept nor cached
+            if cancel_token is not None and cancel_token.cancelled:
+                return self.record_interrupted_answer("")
+            if speculation.cancel_token.cancelled:
+                print("[yellow]\nThe speculative answer was cancelled, asking again.")
+                speculation = None
+            elif speculation.error is not None:
+                raise Exception(f"Error in OpenAI API call: {str(speculation.error)}")
+
+        if speculation:
+            self._append_answer(openai_answer)
+            if context_free:
+                self._cache_answer(prompt, self.chat_history.system_message, openai_answer)
+            print(f"[green]\n{openai_answer}\n")
+            self.compact_context()
+            return openai_answer
 
         print("[yellow]\nAsking ChatGPT a question...")
         try:
-            completion = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=self.chat_history
-            )
-
-            # Add this answer to our chat history
-            self.chat_history.append({"role": completion.choices[0].message.role, "content": completion.choices[0].message.content})
+            # Without streaming the first token arrives with the whole answer
+            with tracer.span("llm.request", prompt_tokens=self.chat_history.total_tokens):
+                completion = self.client.chat.completions.create(
+                    model="gpt-4",
+                    messages=self.chat_history.to_list()
+                )
+            self._mark_http_used()
 
-            # Process the answer
+            # Process the answer and add it to our chat history
             openai_answer = completion.choices[0].message.content
+            self._append_answer(openai_answer)
+            if context_free:
+                self._cache_answer(prompt, self.chat_history.system_message, openai_answer)
             print(f"[green]\n{openai_answer}\n")
+            self.compact_context()
             return openai_answer
         except Exception as e:
-            raise Exception(f"Error in OpenAI API call: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error in OpenAI API call: {str(e)}")
+
+    def stream_completion(self, messages, cancel_token=None):
+        """Yields the answer to messages as content deltas, without touching the chat history.
+
+        Cancelling cancel_token closes the HTTP stream, so no more tokens are generated or
+        billed, and ends the generator quietly.
+        """
+        if not self.client:
+            self.initialize()
+
+        close_stream = None
+        try:
+            completion = self.client.chat.completions.create(
+                model="gpt-4",
+                messages=messages,
+                stream=True
+            )
+            self._mark_http_used()
+            if cancel_token is not None:
+                # Closing the response from the cancelling thread also wakes up the read below
+                close_stream = getattr(completion, 'close', None)
+                if close_stream:
+                    cancel_token.add_callback(close_stream)
+
+            for chunk in completion:
+                if cancel_token is not None and cancel_token.cancelled:
+                    break
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            # A stream closed by cancel() ends with a read error
+            if cancel_token is None or not cancel_token.cancelled:
+                raise Exception(f"Error in OpenAI API call: {str(e)}")
+        finally:
+            if close_stream:
+                cancel_token.remove_callback(close_stream)
+                if cancel_token.cancelled:
+                    close_stream()
+
+    def chat_with_history_streamed(self, prompt="", cancel_token=None, speculation=None):
+        """Yields the answer as content deltas and adds the full answer to the chat history once done.
+
+        Cancelling cancel_token ends the generator without adding anything to the history;
+        the caller then records what was heard with record_interrupted_answer(). A
+        Speculation from the SpeculativePrefetcher is used instead of a new request if it
+        was asked with the same history.
+        """
+        if not self.client:
+            self.initialize()
+
+        if not prompt:
+            print("Didn't receive input!")
+            return
+
+        # Add our prompt into the chat history; its tokens are counted here, once
+        with tracer.span("llm.count_tokens"):
+            self.chat_history.append({"role": "user", "content": prompt})
+
+        # Only a question asked without earlier turns can be answered from, or stored in, the response cache
+        context_free = self._is_first_exchange()
+        speculation = self._accept_speculation(speculation)
+
+        # Check total token limit. Remove old messages as needed
+        print(f"[coral]Chat History has a current token length of {self.chat_history.total_tokens}")
+        popped = self.chat_history.trim(8000)  # Hard limit; the system and summary messages are never popped
+        if popped:
+            print(f"Popped {popped} message(s)! New token length is: {self.chat_history.total_tokens}")
+
+        cached_answer = self._cached_answer(prompt, self.chat_history.system_message) if context_free else None
+        if cached_answer is not None:
+            if speculation:
+                speculation.cancel()
+            self._append_answer(cached_answer)
+            print(f"[green]\n{cached_answer}\n")
+            yield cached_answer
+            self.compact_context()
+            return
+
+        if cancel_token is not None and cancel_token.cancelled:
+            if speculation:
+                speculation.cancel()
+            return
+
+        prompt_tokens = self.chat_history.total_tokens
+        request_start = time.perf_counter()
+        answer_parts = []
+        if speculation:
+            print("[yellow]\nContinuing the speculative answer...")
+            if cancel_token is not None:
+                cancel_token.add_callback(speculation.cancel)
+            deltas = speculation.deltas(cancel_token)
+        else:
+            print("[yellow]\nAsking ChatGPT a question (streaming)...")
+            deltas = self.stream_completion(self.chat_history.to_list(), cancel_token)
+        try:
+            for delta in deltas:
+                if not answer_parts:
+                    tracer.record("llm.first_token", time.perf_counter() - request_start, prompt_tokens=prompt_tokens)
+                answer_parts.append(delta)
+                yield delta
+        finally:
+            if speculation and cancel_token is not None:
+                cancel_token.remove_callback(speculation.cancel)
+        tracer.record("llm.request", time.perf_counter() - request_start, prompt_tokens=prompt_tokens)
+
+        if cancel_token is not None and cancel_token.cancelled:
+            print(f"[yellow]\nCancelled after {len(answer_parts)} streamed chunk(s).")
+            return
+        if speculation and speculation.error is not None:
+            raise Exception(f"Error in OpenAI API call: {str(speculation.error)}")
+        if speculation and speculation.cancel_token.cancelled:
+            # Part of it may already be spoken, so it can't be asked again; don't keep or cache the truncated answer
+            raise Exception("The speculative answer was cancelled before it finished.")
+
+        # Add this answer to our chat history
+        openai_answer = "".join(answer_parts)
+        self._append_answer(openai_answer)
+        if context_free:
+            self._cache_answer(prompt, self.chat_history.system_message, openai_answer)
+        print(f"[green]\n{openai_answer}\n")
+        self.compact_context()
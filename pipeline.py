@@ -0,0 +1,137 @@
+import itertools
+import queue
+import threading
+import time
+from rich import print
+from custom_errors import AIAssistantError, TurnCancelled
+from cancellation import CancelToken
+from tracing import tracer
+
+class Turn:
+    """One interaction as it moves through the pipeline stages."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(self._ids)
+        self.prompt = None
+        self.response = None
+        self.audio_file = None
+        self.error = None
+        self.timings = {}  # Stage name -> seconds spent in that stage
+        self.created_at = time.monotonic()
+        self.stage = None  # Name of the stage working on this turn, None while it waits for the first one
+        self.cancel_token = CancelToken()
+        self.answer_message = None  # The assistant message recorded in the chat history for this turn
+        self.speculation = None  # Answer started from interim speech recognition, see speculation.py
+
+class PipelineStage:
+    """A single worker thread that takes turns from its inbox in order and hands them to the next stage."""
+
+    def __init__(self, name, handler, inbox, outbox=None):
+        self.name = name
+        self.handler = handler
+        self.inbox = inbox
+        self.outbox = outbox
+        self.thread = threading.Thread(target=self._run, name=f"stage-{name}", daemon=True)
+
+    def _run(self):
+        while True:
+            turn = self.inbox.get()
+            try:
+                if turn is None:
+                    if self.outbox is not None:
+                        self.outbox.put(None)
+                    return
+
+                # A turn that failed upstream is passed along untouched so later stages stay in order
+                if turn.error is None and turn.cancel_token.cancelled:
+                    turn.error = TurnCancelled(f"Turn {turn.id} was cancelled before the {self.name} stage.")
+                if turn.error is None:
+                    tracer.set_turn(turn.id)
+                    turn.stage = self.name
+                    start_time = time.perf_counter()
+                    try:
+                        with tracer.span(f"stage.{self.name}"):
+                            self.handler(turn)
+                    except TurnCancelled as e:
+                        turn.error = e
+                        print(f"[yellow]Turn {turn.id} was cancelled during the {self.name} stage.[/yellow]")
+                    except AIAssistantError as e:
+                        turn.error = e
+                        print(f"[red]An error occurred in the {self.name} stage of turn {turn.id}: {str(e)}[/red]")
+                    except Exception as e:
+                        turn.error = e
+                        print(f"[red]Unexpected error in the {self.name} stage of turn {turn.id}: {str(e)}[/red]")
+                    turn.timings[self.name] = time.perf_counter() - start_time
+
+                if self.outbox is not None:
+                    self.outbox.put(turn)
+            finally:
+                self.inbox.task_done()
+
+class InteractionPipeline:
+    """Runs turns through a chain of stages connected by bounded queues.
+
+    Each stage has one worker, so turns leave every stage in the order they were
+    submitted, while different turns can be in different stages at the same time.
+    """
+
+    def __init__(self, stages, max_pending=2):
+        self._queues = [queue.Queue(maxsize=max_pending) for _ in stages]
+        self._done = queue.Queue()
+        self.stages = []
+        for i, (name, handler) in enumerate(stages):
+            outbox = self._queues[i + 1] if i + 1 < len(stages) else self._done
+            self.stages.append(PipelineStage(name, handler, self._queues[i], outbox))
+        self._on_turn_finished = None
+
+    def start(self, on_turn_finished=None):
+        self._on_turn_finished = on_turn_finished
+        for stage in self.stages:
+            stage.thread.start()
+        self._collector = threading.Thread(target=self._collect, name="stage-collector", daemon=True)
+        self._collector.start()
+
+    def submit(self, turn=None, block=False):
+        """Queues a new turn. Returns None if the first stage's queue is full and block is False."""
+        turn = turn or Turn()
+        try:
+            self._queues[0].put(turn, block=block)
+        except queue.Full:
+            return None
+        return turn
+
+    def _collect(self):
+        while True:
+            turn = self._done.get()
+            if turn is None:
+                return
+            if self._on_turn_finished:
+                self._on_turn_finished(turn)
+
+    def cancel_pending(self):
+        """Cancels every turn still waiting for the first stage and reports it as finished."""
+        while True:
+            try:
+                turn = self._queues[0].get_nowait()
+            except queue.Empty:
+                return
+            self._queues[0].task_done()
+            if turn is None:
+                continue
+            turn.cancel_token.cancel()
+            turn.error = TurnCancelled(f"Turn {turn.id} was cancelled before it started.")
+            self._done.put(turn)
+
+    def stop(self, timeout=None):
+        """Stops the stage threads. Turns that haven't started yet are cancelled rather than waited for."""
+        self.cancel_pending()
+        try:
+            self._queues[0].put(None, timeout=timeout)
+        except queue.Full:
+            # Something was submitted meanwhile; the stages are daemon threads, so just stop waiting
+            print("[yellow]Couldn't stop the interaction pipeline cleanly; turns are still queued.[/yellow]")
+        for stage in self.stages:
+            stage.thread.join(timeout)
+        self._collector.join(timeout)
@@ -0,0 +1,360 @@
+import io
+import queue
+import threading
+import wave
+import numpy as np
+from custom_errors import AIAssistantError
+from tracing import tracer
+
+class PCMRingBuffer:
+    """Fixed-size byte ring buffer between a writer thread and the SDL audio callback."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self.total_written = 0
+        self.total_read = 0
+        self._condition = threading.Condition()
+
+    def write(self, data, cancelled=None):
+        """Copies data in, blocking while the buffer is full. Returns False if cancelled() turned true meanwhile."""
+        data = memoryview(data).cast('B')
+        offset = 0
+        with self._condition:
+            while offset < len(data):
+                if cancelled is not None and cancelled():
+                    return False
+                free = self.capacity - (self.total_written - self.total_read)
+                if free == 0:
+                    self._condition.wait(0.1)
+                    continue
+                start = self.total_written % self.capacity
+                length = min(free, len(data) - offset, self.capacity - start)
+                self._buffer[start:start + length] = data[offset:offset + length]
+                offset += length
+                self.total_written += length
+        return True
+
+    def read_into(self, out):
+        """Fills out with as much buffered audio as is available and returns the number of bytes copied."""
+        with self._condition:
+            available = self.total_written - self.total_read
+            copied = 0
+            while copied < len(out) and available > 0:
+                start = self.total_read % self.capacity
+                length = min(available, len(out) - copied, self.capacity - start)
+                out[copied:copied + length] = self._buffer[start:start + length]
+                copied += length
+                available -= length
+                self.total_read += length
+            if copied:
+                self._condition.notify_all()
+            return copied
+
+    def clear(self):
+        with self._condition:
+            self.total_read = self.total_written
+            self._condition.notify_all()
+
+    def _spans(self, position, length):
+        """(start, length) pieces of the backing buffer holding length bytes from absolute position on."""
+        start = position % self.capacity
+        first = min(length, self.capacity - start)
+        return [(start, first)] + ([(0, length - first)] if length > first else [])
+
+    def crossfade(self, position, data, channels):
+        """Fades the audio buffered from position out while fading data in, and drops whatever followed.
+
+        Only the part of data that overlaps buffered audio is mixed in; the number of bytes
+        of data used is returned so the caller can write the rest. Returns 0 and changes
+        nothing if position has already been played or isn't buffered.
+        """
+        data = memoryview(data).cast('B')
+        with self._condition:
+            if position < self.total_read or position >= self.total_written:
+                return 0
+            frame_bytes = channels * 2
+            length = min(len(data), self.total_written - position) // frame_bytes * frame_bytes
+            if length == 0:
+                return 0
+            existing = bytearray(length)
+            offset = 0
+            for start, size in self._spans(position, length):
+                existing[offset:offset + size] = self._buffer[start:start + size]
+                offset += size
+
+            fade_out = np.frombuffer(existing, dtype='<i2').astype(np.float32)
+            fade_in = np.frombuffer(data[:length], dtype='<i2').astype(np.float32)
+            ramp = np.repeat(np.linspace(0.0, 1.0, length // frame_bytes, endpoint=False, dtype=np.float32), channels)
+            mixed = np.clip(fade_out * (1.0 - ramp) + fade_in * ramp, -32768, 32767).astype('<i2').tobytes()
+
+            offset = 0
+            for start, size in self._spans(position, length):
+                self._buffer[start:start + size] = mixed[offset:offset + size]
+                offset += size
+            self.total_written = position + length
+            return length
+
+class PlaybackClip:
+    def __init__(self, data, audio_format, sample_rate, channels):
+        self.data = data
+        self.audio_format = audio_format
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.duration = None  # Seconds, known once decoded
+        self.start_offset = None  # Ring buffer position of this clip's first byte
+        self.end_offset = None  # Ring buffer position just past this clip's last byte
+        self.played_fraction = 0.0  # How much of the clip was heard, set when done; below 1.0 if stopped
+        self.interruptible = False  # A filler: the next clip crossfades into it instead of waiting for its end
+        self.generation = 0  # Engine generation it was queued in; stop() starts a new one
+        self.turn = tracer.current_turn()  # Decoding happens on another thread, so the turn is kept for tracing
+        self.done = threading.Event()
+
+class PlaybackEngine:
+    """Plays in-memory audio clips back to back through one SDL audio device.
+
+    Clips are decoded to 16-bit PCM in the device's format by a worker thread and
+    written into a ring buffer that the SDL audio callback drains, so consecutive
+    clips play without gaps and no file or mixer reload is involved. Each clip's
+    done event is set from the callback once its last sample has been handed to SDL.
+    Works with SDL_AUDIODRIVER=dummy.
+    """
+
+    BYTES_PER_SAMPLE = 2
+
+    def __init__(self, frequency=48000, channels=2, chunk_size=1024, buffer_seconds=10, processor=None, crossfade_ms=150):
+        self.frequency = frequency
+        self.channels = channels
+        self.chunk_size = chunk_size
+        self.crossfade_ms = crossfade_ms
+        self.processor = processor  # Optional AudioPostProcessor applied to every clip once decoded
+        self.ring = PCMRingBuffer(int(frequency * channels * self.BYTES_PER_SAMPLE * buffer_seconds))
+        self.device = None
+        self._decode_queue = queue.Queue()
+        self._pending = []  # Clips written to the ring buffer but not fully played yet
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._generation = 0
+        self._decoder_thread = None
+
+    def open(self):
+        import pygame._sdl2 as sdl2
+        from pygame._sdl2.audio import AudioDevice, AUDIO_S16, get_audio_device_names
+
+        try:
+            sdl2.init_subsystem(sdl2.INIT_AUDIO)
+            self.device = AudioDevice(
+                devicename=get_audio_device_names(False)[0],
+                iscapture=False,
+                frequency=self.frequency,
+                audioformat=AUDIO_S16,
+                numchannels=self.channels,
+                chunksize=self.chunk_size,
+                allowed_changes=0,  # SDL converts to the hardware format, so our PCM layout never changes
+                callback=self._audio_callback
+            )
+        except Exception as e:
+            raise AIAssistantError(f"Failed to open audio device: {str(e)}")
+
+        self._decoder_thread = threading.Thread(target=self._decode_loop, name="playback-decoder", daemon=True)
+        self._decoder_thread.start()
+        self.device.pause(0)
+
+    def close(self):
+        self.stop()
+        if self._decoder_thread:
+            self._decode_queue.put(None)
+            self._decoder_thread.join(timeout=1)
+            self._decoder_thread = None
+        if self.device:
+            self.device.close()
+            self.device = None
+
+    def enqueue(self, data, audio_format='mp3', sample_rate=None, channels=None, interruptible=False):
+        """Queues bytes or a memoryview to play after everything already queued.
+
+        audio_format is 'mp3' or 'wav' (anything soundfile can read), or 'pcm' for raw
+        signed 16-bit little-endian samples at sample_rate with the given channel count.
+        If interruptible is set, the clip queued after it doesn't wait for it to end but
+        crossfades into it over crossfade_ms as soon as it has been decoded.
+        """
+        clip = PlaybackClip(data, audio_format, sample_rate or self.frequency, channels or self.channels)
+        clip.interruptible = interruptible
+        if audio_format == 'pcm':
+            # Raw PCM needs no decoding to know how long it is
+            clip.duration = len(data) / (clip.sample_rate * clip.channels * self.BYTES_PER_SAMPLE)
+        with self._lock:
+            clip.generation = self._generation
+            self._outstanding += 1
+            self._idle.clear()
+        self._decode_queue.put(clip)
+        return clip
+
+    def wait(self, timeout=None):
+        """Blocks until every queued clip has been played. Returns False on timeout."""
+        return self._idle.wait(timeout)
+
+    def stop(self):
+        """Drops everything that is queued or playing."""
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                clip = self._decode_queue.get_nowait()
+            except queue.Empty:
+                break
+            if clip is None:
+                self._decode_queue.put(None)
+                break
+            self._finish(clip)
+        played = self.ring.total_read
+        self.ring.clear()
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for clip in pending:
+            self._finish(clip, self._fraction_played(clip, played))
+
+    def decode(self, data, audio_format='mp3', sample_rate=None, channels=None):
+        """Returns data as int16 PCM bytes (or data itself) in the device's sample rate and channel count.
+
+        PCM already in the device format is passed through untouched, and 16-bit WAV files
+        are read straight from their data chunk; only other formats go through soundfile.
+        """
+        if audio_format == 'wav':
+            pcm_format = self._read_pcm_wav(data)
+            if pcm_format is not None:
+                data, sample_rate, channels = pcm_format
+                audio_format = 'pcm'
+        if audio_format == 'pcm':
+            sample_rate = sample_rate or self.frequency
+            channels = channels or self.channels
+            if sample_rate == self.frequency and channels == self.channels:
+                return data
+            samples = np.frombuffer(data, dtype='<i2').reshape(-1, channels)
+        else:
+            import soundfile as sf
+            samples, sample_rate = sf.read(io.BytesIO(data), dtype='int16', always_2d=True)
+        return self.convert(samples, sample_rate).tobytes()
+
+    def prepare(self, data, audio_format='mp3', sample_rate=None, channels=None, turn=None):
+        """decode() followed by the processor, if any."""
+        with tracer.span("audio.decode", turn=turn, format=audio_format):
+            pcm = self.decode(data, audio_format, sample_rate, channels)
+        if self.processor:
+            with tracer.span("audio.process", turn=turn):
+                pcm = self.processor.process_pcm(pcm, self.frequency, self.channels)
+        return pcm
+
+    @staticmethod
+    def _read_pcm_wav(data):
+        """Returns (frames, sample_rate, channels) for an uncompressed 16-bit WAV, otherwise None."""
+        try:
+            with wave.open(io.BytesIO(data), 'rb') as wav_file:
+                if wav_file.getsampwidth() != 2 or wav_file.getcomptype() != 'NONE':
+                    return None
+                return wav_file.readframes(wav_file.getnframes()), wav_file.getframerate(), wav_file.getnchannels()
+        except (wave.Error, EOFError):
+            return None
+
+    def convert(self, samples, sample_rate):
+        # Match the channel count: duplicate mono, or keep the first channels
+        if samples.shape[1] != self.channels:
+            if samples.shape[1] == 1:
+                samples = np.repeat(samples, self.channels, axis=1)
+            else:
+                samples = samples[:, :self.channels]
+
+        if sample_rate != self.frequency and len(samples):
+            # Linear interpolation is plenty for speech
+            num_frames = int(round(len(samples) * self.frequency / sample_rate))
+            positions = np.linspace(0, len(samples) - 1, num_frames)
+            source = np.arange(len(samples))
+            samples = np.stack(
+                [np.interp(positions, source, samples[:, ch]) for ch in range(self.channels)], axis=1
+            ).round().astype(np.int16)
+        return np.ascontiguousarray(samples, dtype=np.int16)
+
+    def _decode_loop(self):
+        while True:
+            clip = self._decode_queue.get()
+            if clip is None:
+                return
+            try:
+                pcm = self.prepare(clip.data, clip.audio_format, clip.sample_rate, clip.channels, clip.turn)
+            except Exception as e:
+                print(f"Error decoding audio clip: {str(e)}")
+                self._finish(clip)
+                continue
+            clip.data = None
+            clip.duration = len(pcm) / (self.frequency * self.channels * self.BYTES_PER_SAMPLE)  # Byte count, no file reopened
+
+            stopped = lambda: clip.generation != self._generation
+            clip.start_offset = self.ring.total_written  # Only this thread writes
+            pcm = self._crossfade_into_filler(clip, pcm)
+            written = self.ring.write(pcm, stopped)
+            with self._lock:
+                queued = written and not stopped()
+                if queued:
+                    clip.end_offset = self.ring.total_written
+                    self._pending.append(clip)
+            if not queued:
+                # stop() was called while this clip was being decoded or written
+                self.ring.clear()
+                self._finish(clip)
+                continue
+            # The callback may already have played past the end of a short clip
+            self._release_played(self.ring.total_read)
+
+    def _crossfade_into_filler(self, clip, pcm):
+        """If an interruptible clip is still playing, mixes the start of pcm over its fade-out. Returns what is left to write."""
+        with self._lock:
+            filler = self._pending[-1] if self._pending else None
+        if filler is None or not filler.interruptible or not self.crossfade_ms:
+            return pcm
+        frame_bytes = self.channels * self.BYTES_PER_SAMPLE
+        # Leave SDL a couple of callbacks' worth of audio untouched, since it may be reading it right now
+        position = max(filler.start_offset, self.ring.total_read + 2 * self.chunk_size * frame_bytes)
+        position += (filler.start_offset - position) % frame_bytes
+        fade_bytes = int(self.frequency * self.crossfade_ms / 1000) * frame_bytes
+        pcm = memoryview(pcm).cast('B')
+        with tracer.span("audio.crossfade", turn=clip.turn):
+            mixed = self.ring.crossfade(position, pcm[:fade_bytes], self.channels)
+        if not mixed:
+            return pcm
+        with self._lock:
+            filler.end_offset = position + mixed
+        clip.start_offset = position
+        return pcm[mixed:]
+
+    def _audio_callback(self, device, stream):
+        copied = self.ring.read_into(stream)
+        if copied < len(stream):
+            stream[copied:] = bytes(len(stream) - copied)  # Silence while waiting for more audio
+        if self._pending:
+            self._release_played(self.ring.total_read)
+
+    def _release_played(self, played):
+        finished = []
+        with self._lock:
+            while self._pending and self._pending[0].end_offset <= played:
+                finished.append(self._pending.pop(0))
+        for clip in finished:
+            self._finish(clip, 1.0)
+
+    @staticmethod
+    def _fraction_played(clip, played):
+        if clip.start_offset is None or clip.end_offset is None or clip.end_offset <= clip.start_offset:
+            return 0.0
+        return min(1.0, max(0.0, (played - clip.start_offset) / (clip.end_offset - clip.start_offset)))
+
+    def _finish(self, clip, played_fraction=0.0):
+        with self._lock:
+            if clip.done.is_set():
+                return
+            clip.played_fraction = played_fraction
+            clip.done.set()
+            self._outstanding -= 1
+            if self._outstanding == 0:
+                self._idle.set()
@@ -1,40 +1,123 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from openai_chat import OpenAiManager
-from azure_speech_to_text import SpeechToTextManager
-from eleven_labs import ElevenLabsManager
-from audio_player import AudioManager
+from http_sessions import HttpSessionPool
 from custom_errors import AIAssistantError
 
 class ResourceManager:
-    def __init__(self):
-        self.speech_to_text = None
-        self.openai = None
-        self.eleven_labs = None
-        self.audio = None
+    """Owns the four backends. Each one is created and initialized on first use.
+
+    initialize() only sets up the shared HTTP pools and, if prewarm is set, starts
+    initializing all backends in parallel in the background. Whichever backend is
+    needed first is waited for on its own, so startup costs the slowest backend at
+    most rather than the sum of all of them.
+    """
+
+    BACKENDS = ('speech_to_text', 'openai', 'eleven_labs', 'audio')
+
+    def __init__(self, max_connections=8, max_keepalive_connections=4, keepalive_expiry=60.0, warm_up_when_idle=True, prewarm=True,
+                 cache_responses=False, response_cache_ttl=3600, response_similarity_threshold=None, tts_output_format='pcm', playback_rate=44100):
+        self._backends = {}
+        self._backend_locks = {name: threading.Lock() for name in self.BACKENDS}
+        self._executor = None
+        self.http = HttpSessionPool(max_connections, max_keepalive_connections, keepalive_expiry)
+        self.warm_up_when_idle = warm_up_when_idle
+        self.prewarm_on_initialize = prewarm
+        # Optional; only questions asked at the start of a conversation are cached, since later ones depend on context
+        self.cache_responses = cache_responses
+        self.response_cache_ttl = response_cache_ttl
+        # e.g. 0.9 to also answer near-identical rephrasings from the cache; None means exact matches only
+        self.response_similarity_threshold = response_similarity_threshold
+        # 'pcm' has ElevenLabs send raw samples at the playback rate, so nothing is decoded or resampled; 'mp3' keeps MP3
+        self.tts_output_format = tts_output_format
+        self.playback_rate = playback_rate
 
     def initialize(self):
         try:
+            self.http.initialize()
+            if self.warm_up_when_idle:
+                self.http.start_idle_warmer()
+        except Exception as e:
+            raise AIAssistantError(f"Error initializing resources: {str(e)}")
+
+        if self.prewarm_on_initialize:
+            self.prewarm()
+
+    def prewarm(self):
+        """Initializes every backend in parallel on a thread pool without blocking the caller."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.BACKENDS), thread_name_prefix="prewarm")
+        return {name: self._executor.submit(self._prewarm_backend, name) for name in self.BACKENDS}
+
+    def _prewarm_backend(self, name):
+        try:
+            self._get_backend(name)
+        except AIAssistantError as e:
+            # Not fatal here; the first real use will try again and report it
+            print(f"Background initialization of {name} failed: {str(e)}")
+
+    def _create_backend(self, name):
+        # The manager modules pull in the heavy SDKs, so they are only imported when needed
+        if name == 'speech_to_text':
             from azure_speech_to_text import SpeechToTextManager
+            return SpeechToTextManager()
+        if name == 'openai':
             from openai_chat import OpenAiManager
+            response_cache = None
+            if self.cache_responses:
+                from response_cache import ResponseCache
+                response_cache = ResponseCache(ttl=self.response_cache_ttl, similarity_threshold=self.response_similarity_threshold)
+            return OpenAiManager(http_pool=self.http, response_cache=response_cache)
+        if name == 'eleven_labs':
             from eleven_labs import ElevenLabsManager
-            from audio_player import AudioManager
+            eleven_labs = ElevenLabsManager(http_pool=self.http)
+            if self.tts_output_format == 'pcm':
+                rate = eleven_labs.negotiate_output_format([self.playback_rate])
+                if rate is not None and rate != self.playback_rate:
+                    print(f"ElevenLabs has no {self.playback_rate} Hz PCM output, using {rate} Hz and resampling.")
+            return eleven_labs
+        from audio_player import AudioManager
+        if self.tts_output_format == 'pcm':
+            # ElevenLabs speech is mono; SDL spreads it over the speakers for free
+            return AudioManager(frequency=self.playback_rate, channels=1)
+        return AudioManager()
 
-            self.speech_to_text = SpeechToTextManager()
-            self.speech_to_text.initialize()
+    def _get_backend(self, name):
+        backend = self._backends.get(name)
+        if backend is not None:
+            return backend
+        with self._backend_locks[name]:
+            backend = self._backends.get(name)
+            if backend is None:
+                try:
+                    backend = self._create_backend(name)
+                    backend.initialize()
+                except Exception as e:
+                    raise AIAssistantError(f"Error initializing {name}: {str(e)}")
+                self._backends[name] = backend
+            return backend
 
-            self.openai = OpenAiManager()
-            self.openai.initialize()
+    @property
+    def speech_to_text(self):
+        return self._get_backend('speech_to_text')
 
-            self.eleven_labs = ElevenLabsManager()
-            self.eleven_labs.initialize()
+    @property
+    def openai(self):
+        return self._get_backend('openai')
 
-            self.audio = AudioManager()
-            self.audio.initialize()
-        except Exception as e:
-            raise AIAssistantError(f"Error initializing resources: {str(e)}")
+    @property
+    def eleven_labs(self):
+        return self._get_backend('eleven_labs')
+
+    @property
+    def audio(self):
+        return self._get_backend('audio')
 
     def cleanup(self):
-        for resource in [self.speech_to_text, self.openai, self.eleven_labs, self.audio]:
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for resource in [self._backends.get(name) for name in self.BACKENDS] + [self.http]:
             if resource:
                 try:
                     resource.cleanup()
@@ -0,0 +1,132 @@
+import hashlib
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+
+def normalize_prompt(prompt):
+    """Lowercases, drops punctuation and collapses whitespace, so trivially different phrasings share a key."""
+    return " ".join(re.sub(r"[^\w\s]", " ", prompt.lower()).split())
+
+class ResponseCache:
+    """Caches answers by normalized prompt and system message, with optional fuzzy matching.
+
+    Exact lookups use a dict keyed on (system message hash, normalized prompt). When
+    similarity_threshold is set, a miss falls back to cosine similarity over hashed
+    character n-gram embeddings, stored as rows of one preallocated NumPy matrix so a
+    lookup is a single matrix-vector product. Entries expire after ttl seconds and the
+    least recently used entry is evicted once max_entries is reached.
+    """
+
+    def __init__(self, ttl=3600, max_entries=512, similarity_threshold=None, ngram_size=3, dimensions=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.ngram_size = ngram_size
+        self.dimensions = dimensions
+        self._entries = OrderedDict()  # key -> (answer, stored_at, slot), least recently used first
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self._slot_system = np.zeros(max_entries, dtype=np.int64)  # system message hash for each slot
+        self._slot_active = np.zeros(max_entries, dtype=bool)
+        self._slot_keys = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _system_hash(system_message):
+        content = system_message.get('content', '') if isinstance(system_message, dict) else (system_message or '')
+        return int.from_bytes(hashlib.sha256(content.encode('utf-8')).digest()[:8], 'little', signed=True)
+
+    def embed(self, normalized_prompt):
+        """Hashed character n-gram counts, L2-normalized."""
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        text = f" {normalized_prompt} "
+        if len(text) >= self.ngram_size:
+            buckets = [zlib.crc32(text[i:i + self.ngram_size].encode('utf-8')) % self.dimensions
+                       for i in range(len(text) - self.ngram_size + 1)]
+            np.add.at(vector, buckets, 1.0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, prompt, system_message=None):
+        normalized = normalize_prompt(prompt)
+        system_hash = self._system_hash(system_message)
+        key = (system_hash, normalized)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            if self.similarity_threshold is not None and self._entries:
+                similar_key = self._most_similar(normalized, system_hash)
+                if similar_key is not None:
+                    similar_entry = self._entries[similar_key]
+                    if now - similar_entry[1] <= self.ttl:
+                        self._entries.move_to_end(similar_key)
+                        self.similar_hits += 1
+                        return similar_entry[0]
+                    self._remove(similar_key)
+
+            self.misses += 1
+            return None
+
+    def _most_similar(self, normalized, system_hash):
+        candidates = np.flatnonzero(self._slot_active & (self._slot_system == system_hash))
+        if not len(candidates):
+            return None
+        scores = self._vectors[candidates] @ self.embed(normalized)
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        return self._slot_keys[candidates[best]]
+
+    def put(self, prompt, system_message, answer):
+        if not answer:
+            return
+        normalized = normalize_prompt(prompt)
+        system_hash = self._system_hash(system_message)
+        key = (system_hash, normalized)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while not self._free_slots:
+                self._remove(next(iter(self._entries)))
+            slot = self._free_slots.pop()
+            self._vectors[slot] = self.embed(normalized)
+            self._slot_system[slot] = system_hash
+            self._slot_active[slot] = True
+            self._slot_keys[slot] = key
+            self._entries[key] = (answer, time.monotonic(), slot)
+
+    def _remove(self, key):
+        _, _, slot = self._entries.pop(key)
+        self._slot_active[slot] = False
+        self._slot_keys[slot] = None
+        self._free_slots.append(slot)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    @property
+    def metrics(self):
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.similar_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,204 @@
+import difflib
+import threading
+import time
+from rich import print
+from cancellation import CancelToken
+from response_cache import normalize_prompt
+from tracing import tracer
+
+def transcripts_match(a, b, threshold=0.9):
+    """True if two transcripts agree after normalization, with a word-level similarity of at least threshold."""
+    a_words = normalize_prompt(a).split()
+    b_words = normalize_prompt(b).split()
+    if a_words == b_words:
+        return True
+    if not a_words or not b_words:
+        return False
+    return difflib.SequenceMatcher(None, a_words, b_words, autojunk=False).ratio() >= threshold
+
+class Speculation:
+    """An answer streamed in the background for an interim transcript.
+
+    The deltas are buffered as they arrive, so whoever accepts the speculation can
+    replay what came in so far and then follow the rest of the stream live.
+    """
+
+    def __init__(self, prefetcher, prompt, history):
+        self.prefetcher = prefetcher
+        self.prompt = prompt
+        self.history = history  # The messages it was asked with, without the prompt itself
+        self.cancel_token = CancelToken()
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.error = None
+        self._parts = []
+        self._done = False
+        self._condition = threading.Condition()
+
+    def _run(self, stream):
+        try:
+            for delta in stream:
+                with self._condition:
+                    self._parts.append(delta)
+                    self._condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._condition:
+                self._done = True
+                self.finished_at = time.monotonic()
+                self._condition.notify_all()
+
+    @property
+    def failed(self):
+        return self.error is not None or self.cancel_token.cancelled
+
+    def cancel(self):
+        self.cancel_token.cancel()
+        with self._condition:
+            self._condition.notify_all()
+
+    def accept(self, history):
+        """Claims the speculation for a real request asked with history. Returns False, and cancels it, if it can't be used."""
+        if self.failed or history != self.history:
+            self.cancel()
+            self.prefetcher._record(self, hit=False)
+            return False
+        self.prefetcher._record(self, hit=True)
+        return True
+
+    def deltas(self, cancel_token=None):
+        """Yields the answer deltas, the buffered ones first, until the answer is complete or cancelled."""
+        index = 0
+        while True:
+            with self._condition:
+                while index == len(self._parts) and not self._done and not self.cancel_token.cancelled:
+                    self._condition.wait()
+                parts = self._parts[index:]
+                finished = self._done or self.cancel_token.cancelled
+            index += len(parts)
+            yield from parts
+            if finished or (cancel_token is not None and cancel_token.cancelled):
+                return
+
+class SpeculativePrefetcher:
+    """Starts answering a question while the user is still saying it.
+
+    Interim hypotheses from speech recognition are fed in through on_partial and
+    on_final. Once the transcript stops changing for stable_ms, a streamed completion
+    is started for it in the background. finish_turn() hands that speculation over
+    if the final transcript matches the one it was started for, within match_threshold;
+    otherwise it is cancelled and the question is asked again as usual. Hit rate and
+    the time saved are tracked in metrics.
+    """
+
+    def __init__(self, openai_manager, stable_ms=400, min_words=4, match_threshold=0.9):
+        self.openai = openai_manager
+        self.stable_ms = stable_ms
+        self.min_words = min_words  # Very short hypotheses change too often to be worth a request
+        self.match_threshold = match_threshold
+        self._lock = threading.Lock()
+        self._timer = None
+        self._finals = []
+        self._speculation = None
+        self.speculations = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def start_turn(self):
+        self.discard()
+        with self._lock:
+            self._finals = []
+
+    def on_partial(self, text):
+        with self._lock:
+            transcript = " ".join(self._finals + [text])
+        self._hypothesis(transcript)
+
+    def on_final(self, text):
+        with self._lock:
+            self._finals.append(text)
+            transcript = " ".join(self._finals)
+        self._hypothesis(transcript)
+
+    def _hypothesis(self, transcript):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            if len(normalize_prompt(transcript).split()) < self.min_words:
+                return
+            self._timer = threading.Timer(self.stable_ms / 1000, self._speculate, args=(transcript,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _speculate(self, transcript):
+        history = self.openai.chat_history.to_list()
+        with self._lock:
+            current = self._speculation
+            if current is not None and not current.failed and transcripts_match(current.prompt, transcript, self.match_threshold):
+                return
+            if current is not None:
+                current.cancel()
+            speculation = Speculation(self, transcript, history)
+            self._speculation = speculation
+            self.speculations += 1
+        print(f"[coral]Speculatively asking: {transcript}")
+        stream = self.openai.stream_completion(history + [{"role": "user", "content": transcript}], speculation.cancel_token)
+        threading.Thread(target=speculation._run, args=(stream,), name="speculation", daemon=True).start()
+
+    def finish_turn(self, transcript):
+        """Returns the speculation started for transcript, or None. A mismatching one is cancelled."""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            speculation, self._speculation = self._speculation, None
+        if speculation is None:
+            return None
+        if not transcript or not transcripts_match(speculation.prompt, transcript, self.match_threshold):
+            speculation.cancel()
+            self._record(speculation, hit=False)
+            print("[coral]The speculative answer doesn't fit the final transcript; asking again.")
+            return None
+        return speculation
+
+    def discard(self):
+        """Cancels any pending or running speculation, e.g. when the turn is cancelled."""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            speculation, self._speculation = self._speculation, None
+        if speculation is not None:
+            speculation.cancel()
+
+    def cleanup(self):
+        self.discard()
+
+    def _record(self, speculation, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            # Without the speculation the request would only have started now
+            saved = min(time.monotonic(), speculation.finished_at or float('inf')) - speculation.started_at
+            with self._lock:
+                self.saved_seconds += saved
+            tracer.record("llm.speculation_saved", saved)
+            print(f"[coral]Using the speculative answer, started {saved:.2f}s early ({self.metrics['hit_rate']:.0%} hit rate).")
+
+    @property
+    def metrics(self):
+        finished = self.hits + self.misses
+        return {
+            "speculations": self.speculations,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / finished if finished else 0.0,
+            "saved_seconds": self.saved_seconds,
+            "average_saved_seconds": self.saved_seconds / self.hits if self.hits else 0.0,
+        }
@@ -0,0 +1,142 @@
+import re
+import queue
+import threading
+import time
+from rich import print
+from custom_errors import AIAssistantError, TurnCancelled
+from tracing import tracer
+
+# A sentence ends at ., ! or ? (optionally followed by closing quotes/brackets) and then whitespace
+SENTENCE_END = re.compile(r'[.!?…]+["\')\]]*\s+')
+
+class SentenceChunker:
+    """Buffers streamed text deltas and hands back complete sentences as soon as they end."""
+
+    def __init__(self, min_chars=20):
+        # Very short sentences ("Oh!") are merged with the next one so TTS isn't called for a single word
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, delta):
+        self._buffer += delta
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            if match.end() - start < self.min_chars:
+                continue
+            sentences.append(self._buffer[start:match.end()].strip())
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return [remainder] if remainder else []
+
+def spoken_prefix(text, fraction):
+    """The words of text heard when playback stopped fraction of the way through its audio."""
+    words = text.split()
+    return " ".join(words[:int(len(words) * fraction)])
+
+class StreamingPipeline:
+    """Runs one turn as LLM deltas -> sentence chunks -> TTS -> gapless playback."""
+
+    def __init__(self, resource_manager, voice, on_partial_response=None):
+        self.resource_manager = resource_manager
+        self.voice = voice
+        self.on_partial_response = on_partial_response
+        self.time_to_first_audio = None
+        self.cancelled = False
+        self.sentences = []  # The chunks the answer was synthesized in, which is how the TTS cache holds it
+
+    def run(self, prompt, cancel_token=None, speculation=None):
+        """Speaks the answer to prompt and returns its text.
+
+        speculation is an answer the SpeculativePrefetcher already started for prompt;
+        chat_with_history_streamed() uses it if it still fits the chat history.
+
+        Cancelling cancel_token stops playback at once, closes the OpenAI and ElevenLabs
+        streams and drops sentences that weren't synthesized yet. The chat history then
+        only keeps what was actually heard, which is also what gets returned, and
+        self.cancelled is set.
+        """
+        openai = self.resource_manager.openai
+        audio = self.resource_manager.audio
+        sentence_queue = queue.Queue()
+        tts_errors = []
+        spoken = []  # (sentence, clip) in playback order
+        start_time = time.perf_counter()
+        first_audio_time = None
+        turn_id = tracer.current_turn()
+        previous_answer = openai.last_answer_message
+
+        def is_cancelled():
+            return cancel_token is not None and cancel_token.cancelled
+
+        def tts_worker():
+            nonlocal first_audio_time
+            tracer.set_turn(turn_id)
+            while True:
+                sentence = sentence_queue.get()
+                if sentence is None:
+                    return
+                if tts_errors or is_cancelled():
+                    continue
+                try:
+                    audio_bytes = self.resource_manager.eleven_labs.text_to_audio_bytes(sentence, self.voice, cancel_token)
+                    if first_audio_time is None:
+                        first_audio_time = time.perf_counter() - start_time
+                        tracer.record("turn.first_audio", first_audio_time)
+                    spoken.append((sentence, audio.enqueue_audio(audio_bytes, **self.resource_manager.eleven_labs.playback_format)))
+                    if is_cancelled():
+                        # Cancelled between the check and the enqueue; stop() may already have run
+                        audio.stop()
+                except TurnCancelled:
+                    continue
+                except AIAssistantError as e:
+                    tts_errors.append(e)
+
+        if cancel_token is not None:
+            cancel_token.add_callback(audio.stop)
+        tts_thread = threading.Thread(target=tts_worker, daemon=True)
+        tts_thread.start()
+
+        chunker = SentenceChunker()
+        try:
+            for delta in openai.chat_with_history_streamed(prompt, cancel_token, speculation) or []:
+                if self.on_partial_response:
+                    self.on_partial_response(delta)
+                for sentence in chunker.feed(delta):
+                    self.sentences.append(sentence)
+                    sentence_queue.put(sentence)
+            if not is_cancelled():
+                for sentence in chunker.flush():
+                    self.sentences.append(sentence)
+                    sentence_queue.put(sentence)
+        finally:
+            sentence_queue.put(None)
+            if not is_cancelled():
+                tts_thread.join()
+
+        if tts_errors and not is_cancelled():
+            raise tts_errors[0]
+
+        self.time_to_first_audio = first_audio_time
+        if first_audio_time is not None:
+            print(f"[coral]Time to first audio: {first_audio_time:.2f}s")
+        with tracer.span("audio.playback"):
+            # stop() marks every queued clip done, so a cancel ends this wait straight away
+            for _, clip in list(spoken):
+                clip.done.wait()
+        if cancel_token is not None:
+            cancel_token.remove_callback(audio.stop)
+
+        if is_cancelled():
+            self.cancelled = True
+            heard = " ".join(filter(None, (spoken_prefix(sentence, clip.played_fraction) for sentence, clip in list(spoken))))
+            # The full answer is only in the history if the stream finished before the cancel
+            answer_message = openai.last_answer_message if openai.last_answer_message is not previous_answer else None
+            return openai.record_interrupted_answer(heard, answer_message)
+
+        return openai.last_answer_message['content'] if openai.last_answer_message is not previous_answer else ""
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+class RollingPercentiles:
+    """Keeps the last `window` values and answers percentile queries over them."""
+
+    def __init__(self, window=200):
+        self.values = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, value):
+        self.values.append(value)
+        self.count += 1
+
+    def percentile(self, p):
+        """Nearest-rank percentile, or None if nothing was recorded yet."""
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Adds attributes that are only known once the work is done, e.g. a byte count."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.attrs['error'] = repr(exc)
+        self.tracer._finish_span(self.name, self.start, time.perf_counter() - self.start, self.attrs)
+        return False
+
+class Tracer:
+    """Monotonic-clock spans and metrics for one process, exportable as JSONL and Chrome trace events.
+
+    While disabled, span() hands back a shared no-op context manager and record() returns
+    straight away, so the instrumentation left in the code costs a function call and a
+    flag check. Each span or metric also feeds a rolling histogram per name.
+
+    The turn a span belongs to comes from a thread-local, set with set_turn() by whoever
+    starts work on a turn in a thread.
+    """
+
+    def __init__(self, window=200, max_events=100000):
+        self.enabled = False
+        self.window = window
+        self.histograms = {}
+        self._events = deque(maxlen=max_events)
+        self._thread_names = {}
+        self._jsonl = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def enable(self, jsonl_path=None):
+        """Starts recording; spans are also appended to jsonl_path as they finish, if given."""
+        with self._lock:
+            if jsonl_path and self._jsonl is None:
+                self._jsonl = open(jsonl_path, 'a', encoding='utf-8')
+            self.enabled = True
+
+    def disable(self):
+        with self._lock:
+            self.enabled = False
+            if self._jsonl:
+                self._jsonl.close()
+                self._jsonl = None
+
+    def set_turn(self, turn_id):
+        self._local.turn = turn_id
+
+    def current_turn(self):
+        return getattr(self._local, 'turn', None)
+
+    def span(self, name, **attrs):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, attrs)
+
+    def record(self, name, seconds, **attrs):
+        """Records a measured value such as time to first token, ending now."""
+        if self.enabled:
+            self._finish_span(name, time.perf_counter() - seconds, seconds, attrs)
+
+    def _finish_span(self, name, start, duration, attrs):
+        turn = self.current_turn()
+        if turn is not None:
+            attrs.setdefault('turn', turn)
+        thread = threading.current_thread()
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = RollingPercentiles(self.window)
+            histogram.add(duration)
+            self._thread_names[thread.ident] = thread.name
+            self._events.append((name, start, duration, thread.ident, attrs))
+            if self._jsonl:
+                self._jsonl.write(json.dumps({"name": name, "start": round(start - self._origin, 6),
+                                              "seconds": round(duration, 6), "thread": thread.name, **attrs}) + "\n")
+
+    def summary(self):
+        """Returns {name: {"count", "p50", "p95"}} in seconds, over each histogram's rolling window."""
+        with self._lock:
+            return {name: {"count": histogram.count, "p50": histogram.percentile(50), "p95": histogram.percentile(95)}
+                    for name, histogram in sorted(self.histograms.items())}
+
+    def export_chrome_trace(self, path):
+        """Writes the recorded spans as a Chrome trace-event file, viewable in chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        with self._lock:
+            events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}}
+                      for tid, thread_name in self._thread_names.items()]
+            for name, start, duration, tid, attrs in self._events:
+                events.append({"name": name, "cat": name.split('.')[0], "ph": "X", "pid": pid, "tid": tid,
+                               "ts": round((start - self._origin) * 1e6, 1), "dur": round(duration * 1e6, 1),
+                               "args": attrs})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+tracer = Tracer()
+span = tracer.span
+record = tracer.record
@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+class TTSCache:
+    """Persistent, content-addressed store of synthesized audio with LRU eviction.
+
+    Entries are keyed by a SHA-256 digest of (text, voice, model, format), so the same
+    line maps to the same file across restarts. The LRU order is kept in index.json,
+    which is written by a background timer at most every flush_delay seconds rather than
+    on every put, and once more by save_index() at shutdown.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir="tts_cache", max_entries=1000, max_bytes=256 * 1024 * 1024, flush_delay=2.0):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.flush_delay = flush_delay
+        self._entries = OrderedDict()  # key -> (file name, size in bytes), least recently used first
+        self._total_bytes = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_timer = None
+        self._load_index()
+
+    @staticmethod
+    def make_key(text, voice, model, audio_format):
+        payload = json.dumps([text, voice, model, audio_format], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_FILE), 'r') as f:
+                saved_entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            saved_entries = []
+
+        for key, file_name, size in saved_entries:
+            # Drop entries whose file was removed behind our back
+            if os.path.exists(os.path.join(self.cache_dir, file_name)):
+                self._entries[key] = (file_name, size)
+                self._total_bytes += size
+
+    def save_index(self):
+        """Writes index.json now if anything changed, replacing a pending background flush."""
+        with self._write_lock:
+            with self._lock:
+                if self._flush_timer:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if not self._dirty:
+                    return
+                entries = [[key, file_name, size] for key, (file_name, size) in self._entries.items()]
+                self._dirty = False
+            index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+            tmp_path = index_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, index_path)
+
+    def _schedule_flush(self):
+        # Called with self._lock held; puts in quick succession share a single write
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay, self._flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush(self):
+        try:
+            self.save_index()
+        except OSError as e:
+            print(f"Couldn't save the TTS cache index: {str(e)}")
+
+    def get_path(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._dirty = True
+            return os.path.join(self.cache_dir, entry[0])
+
+    def get_bytes(self, key):
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                self._forget(key)
+            return None
+
+    def put(self, key, audio_bytes, extension="mp3"):
+        file_name = f"{key}.{extension}"
+        path = os.path.join(self.cache_dir, file_name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(audio_bytes)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = (file_name, len(audio_bytes))
+            self._total_bytes += len(audio_bytes)
+            self._evict()
+            self._dirty = True
+            self._schedule_flush()
+        return path
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+            self._dirty = True
+
+    def _evict(self):
+        # Never evict the entry that was just added, even if it alone is over budget
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            _, (file_name, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                pass
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
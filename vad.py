@@ -0,0 +1,70 @@
+import numpy as np
+
+class EnergyVAD:
+    """Frame-energy / zero-crossing voice activity detector used to end a turn automatically.
+
+    Audio is 16-bit mono PCM. Features for all frames in a chunk are computed at once with
+    NumPy; the per-frame state machine then decides when speech started and when it has
+    been followed by silence_ms of non-speech (the endpoint). The noise floor adapts to
+    the room while nobody is speaking.
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=20, speech_margin_db=12.0, min_speech_ms=150,
+                 silence_ms=700, initial_noise_db=-60.0, max_zero_crossing_rate=0.35):
+        self.sample_rate = sample_rate
+        self.frame_length = sample_rate * frame_ms // 1000
+        self.frame_ms = frame_ms
+        self.speech_margin_db = speech_margin_db
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.silence_frames = max(1, silence_ms // frame_ms)
+        # Hiss and fricative-only noise cross zero far more often than voiced speech
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+        self.noise_db = initial_noise_db
+        self.reset()
+
+    def reset(self):
+        self._remainder = np.zeros(0, dtype=np.int16)
+        self.in_speech = False
+        self.speech_detected = False
+        self.endpoint_detected = False
+        self._speech_run = 0
+        self._silence_run = 0
+
+    def frame_features(self, samples):
+        """Returns (energy in dBFS, zero-crossing rate) for each whole frame in samples."""
+        num_frames = len(samples) // self.frame_length
+        frames = samples[:num_frames * self.frame_length].reshape(num_frames, self.frame_length).astype(np.float32) / 32768.0
+        energy_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        signs = np.signbit(frames)
+        zero_crossing_rate = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (self.frame_length - 1)
+        return energy_db, zero_crossing_rate
+
+    def process(self, pcm_bytes):
+        """Feeds raw PCM. Returns True once the endpoint (speech followed by enough silence) is reached."""
+        samples = np.concatenate([self._remainder, np.frombuffer(pcm_bytes, dtype='<i2')])
+        usable = len(samples) - len(samples) % self.frame_length
+        self._remainder = samples[usable:]
+        if not usable:
+            return self.endpoint_detected
+
+        energy_db, zero_crossing_rate = self.frame_features(samples[:usable])
+        is_speech = (energy_db > self.noise_db + self.speech_margin_db) & (zero_crossing_rate < self.max_zero_crossing_rate)
+
+        for frame_energy, speech in zip(energy_db, is_speech):
+            if speech:
+                self._speech_run += 1
+                self._silence_run = 0
+                if self._speech_run >= self.min_speech_frames:
+                    self.in_speech = True
+                    self.speech_detected = True
+            else:
+                self._speech_run = 0
+                self._silence_run += 1
+                if not self.in_speech:
+                    # Track the room's noise floor; rise slowly so speech onsets don't drag it up
+                    rate = 0.05 if frame_energy > self.noise_db else 0.2
+                    self.noise_db += rate * (frame_energy - self.noise_db)
+                elif self._silence_run >= self.silence_frames:
+                    self.in_speech = False
+                    self.endpoint_detected = True
+        return self.endpoint_detected
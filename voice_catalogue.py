@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import time
+
+class VoiceCatalogue:
+    """ElevenLabs voices cached on disk with a TTL and a name -> voice ID index.
+
+    fetch_voices is a callable returning a list of {"voice_id", "name", ...} dicts.
+    A stale catalogue is still served while a background refresh replaces it.
+    """
+
+    def __init__(self, fetch_voices, cache_file="voice_catalogue.json", ttl=24 * 60 * 60, miss_refresh_interval=60):
+        self.fetch_voices = fetch_voices
+        self.cache_file = os.path.abspath(cache_file)
+        self.ttl = ttl
+        # An unknown name triggers a refresh at most this often, e.g. for a voice created since the last fetch
+        self.miss_refresh_interval = miss_refresh_interval
+        self._last_miss_refresh = float('-inf')
+        self._voice_ids = set()
+        self.voices = []
+        self.fetched_at = 0.0
+        self._ids_by_name = {}
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def load(self):
+        """Loads the catalogue from disk and starts a background refresh if it is missing or stale."""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            self._replace(saved['voices'], saved['fetched_at'])
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
+            pass
+
+        if self.is_stale():
+            self.refresh_in_background()
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.ttl
+
+    def _replace(self, voices, fetched_at):
+        ids_by_name = {}
+        for voice in voices:
+            # Keep the first voice when several share a name
+            ids_by_name.setdefault(voice['name'], voice['voice_id'])
+        with self._lock:
+            self.voices = voices
+            self.fetched_at = fetched_at
+            self._ids_by_name = ids_by_name
+            self._voice_ids = {voice['voice_id'] for voice in voices}
+
+    def refresh(self):
+        voices = [{"voice_id": v["voice_id"], "name": v["name"], "category": v.get("category")} for v in self.fetch_voices()]
+        fetched_at = time.time()
+        self._replace(voices, fetched_at)
+
+        tmp_path = self.cache_file + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"fetched_at": fetched_at, "voices": voices}, f, indent=2)
+        os.replace(tmp_path, self.cache_file)
+
+    def refresh_in_background(self):
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+
+        def refresh_quietly():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Couldn't refresh the ElevenLabs voice catalogue: {str(e)}")
+
+        self._refresh_thread = threading.Thread(target=refresh_quietly, name="voice-catalogue-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def voice_id(self, name):
+        """Returns the voice ID for a voice name, or None if the name isn't in the catalogue."""
+        voice_id = self._ids_by_name.get(name)
+        if voice_id is not None or name in self._voice_ids:
+            return voice_id
+
+        if not self.voices:
+            # First run with no cache yet; wait for the catalogue rather than guessing
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                self._refresh_thread.join()
+            else:
+                self.refresh()
+        elif time.monotonic() - self._last_miss_refresh >= self.miss_refresh_interval:
+            # The voice may have been created or renamed since the cached catalogue was fetched
+            self._last_miss_refresh = time.monotonic()
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                self._refresh_thread.join()
+            else:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Couldn't refresh the ElevenLabs voice catalogue: {str(e)}")
+        return self._ids_by_name.get(name)